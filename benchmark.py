@@ -0,0 +1,203 @@
+"""Offline benchmarks of the pipeline against the mock KoboldCpp server
+
+    python benchmark.py [--quick] [--output bench_output.txt]
+
+Reports parser cost, client-side overhead per request and token,
+per-stage timings at a simulated generation speed and how throughput
+scales with concurrent books. No GPU or model is needed; pass --replay
+to answer from a recorded session instead of synthetic text.
+"""
+import io
+import sys
+import time
+import timeit
+import argparse
+import contextlib
+
+from goat_storytelling_agent.storytelling_agent import StoryAgent
+from goat_storytelling_agent.scheduler import BatchScheduler
+from goat_storytelling_agent.mock_server import (MockKoboldServer,
+                                                 SyntheticResponder,
+                                                 stream_tokens)
+from goat_storytelling_agent.monitors import SceneHeaderStop, RepetitionMonitor
+from goat_storytelling_agent.plan import Plan, PlanStreamParser, SceneStreamParser
+from goat_storytelling_agent import utils
+
+
+def _request(content):
+    return {'messages': [{'role': 'user', 'content': content}]}
+
+
+def _per_call(func, number):
+    return timeit.timeit(func, number=number) / number
+
+
+def bench_parsers(report, number):
+    responder = SyntheticResponder(scene_words=1500)
+    text_plan = responder(_request('Come up with a plot'))
+    act_scenes = responder(_request('Break each chapter in Act 1'))
+    scene = 'Chapter 1\nScene 1\n\n' + responder(_request('Write a scene'))
+    manuscript = '\n\n'.join(responder(_request(f'Write scene {i}'))
+                             for i in range(40))
+    plan = [{'act_scenes': act_scenes}]
+    tokens = stream_tokens(scene)
+
+    def feed(parser):
+        for token in tokens:
+            parser.feed(token)
+
+    def feed_plan():
+        parser = PlanStreamParser()
+        for token in stream_tokens(text_plan):
+            parser.feed(token)
+        parser.close()
+
+    def feed_scenes():
+        parser = SceneStreamParser([1, 2])
+        for token in stream_tokens(act_scenes):
+            parser.feed(token)
+        parser.close()
+
+    cases = [
+        ('Plan.parse_text_plan', lambda: Plan.parse_text_plan(text_plan)),
+        ('PlanStreamParser (per plan)', feed_plan),
+        ('parse act scenes', lambda: StoryAgent._parse_act_scenes(
+            plan, {1: [1, 2]})),
+        ('SceneStreamParser (per act)', feed_scenes),
+        ('prepare_scene_text', lambda: StoryAgent.prepare_scene_text(scene)),
+        ('keep_last_n_words (40 scenes)',
+         lambda: utils.keep_last_n_words(manuscript, 400)),
+    ]
+    report('Parser cost')
+    for name, func in cases:
+        report(f'  {name:<36} {_per_call(func, number) * 1e6:10.1f} us')
+    for name, monitor in [('SceneHeaderStop', SceneHeaderStop()),
+                          ('RepetitionMonitor', RepetitionMonitor())]:
+        per_scene = _per_call(lambda: (monitor.reset(), feed(monitor)),
+                              max(number // 10, 1))
+        report(f'  {name + " (per token)":<36} '
+               f'{per_scene / len(tokens) * 1e6:10.2f} us')
+
+
+def _run_story(agent, topic):
+    # Progress messages go to stdout, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return agent.generate_story(topic)
+
+
+def bench_overhead(report, responder, replay):
+    """Client cost with a server that answers instantly"""
+    with MockKoboldServer(responder=responder, replay=replay) as server:
+        agent = StoryAgent(server.uri, token_sink='silent')
+        _run_story(agent, 'warm up')
+        n_requests, n_tokens = server.n_requests, server.n_tokens
+        start = time.perf_counter()
+        _run_story(agent, 'a heist in Bangkok')
+        elapsed = time.perf_counter() - start
+        n_requests = server.n_requests - n_requests
+        n_tokens = server.n_tokens - n_tokens
+        agent.close()
+    report('Client overhead (instant server)')
+    report(f'  generate_story                       {elapsed:10.3f} s, '
+           f'{n_requests} requests, {n_tokens} tokens')
+    report(f'  per request                          '
+           f'{elapsed / n_requests * 1e3:10.2f} ms')
+    report(f'  per token                            '
+           f'{elapsed / n_tokens * 1e6:10.2f} us')
+
+
+def bench_stages(report, responder, replay, tokens_per_s, latency):
+    """Per-stage timings at a simulated generation speed"""
+    with MockKoboldServer(responder=responder, replay=replay,
+                          tokens_per_s=tokens_per_s, latency=latency) as server:
+        agent = StoryAgent(server.uri, token_sink='silent')
+        start = time.perf_counter()
+        _run_story(agent, 'a heist in Bangkok')
+        elapsed = time.perf_counter() - start
+        agent.close()
+    report(f'Stages ({tokens_per_s} tokens/s, {latency * 1e3:.0f} ms '
+           f'to first token)')
+    report(f'  {"stage":<28}{"calls":>6}{"reqs":>6}{"seconds":>10}'
+           f'{"ttft":>8}{"tok/s":>8}')
+    for stage, values in agent.metrics.summary().items():
+        if not values['requests']:
+            continue
+        ttft = values['ttft_seconds'] / values['requests']
+        speed = (values['completion_tokens'] / values['generation_seconds']
+                 if values['generation_seconds'] else 0)
+        report(f'  {str(stage):<28}{values["stage_calls"]:>6}'
+               f'{values["requests"]:>6}{values["stage_seconds"]:>10.2f}'
+               f'{ttft:>8.3f}{speed:>8.0f}')
+    report(f'  total                                {elapsed:10.2f} s')
+
+
+def bench_scaling(report, responder, replay, tokens_per_s, latency,
+                  n_books, levels):
+    """Throughput of a batch of books by number of requests in flight"""
+    report(f'Concurrency scaling ({n_books} books, {tokens_per_s} tokens/s '
+           f'per request)')
+    baseline = None
+    for max_in_flight in levels:
+        with MockKoboldServer(responder=responder, replay=replay,
+                              tokens_per_s=tokens_per_s,
+                              latency=latency) as server:
+            scheduler = BatchScheduler(backend_uri=server.uri,
+                                       max_in_flight=max_in_flight,
+                                       max_active_books=n_books,
+                                       token_sink='silent')
+            for i in range(n_books):
+                scheduler.submit(f'book {i}')
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scheduler.run_sync()
+            elapsed = time.perf_counter() - start
+            scheduler.agent.close()
+            throughput = server.n_tokens / elapsed
+        baseline = baseline or throughput
+        report(f'  {max_in_flight:>3} in flight {elapsed:10.2f} s '
+               f'{throughput:10.0f} tokens/s {throughput / baseline:6.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer repetitions and smaller batches')
+    parser.add_argument('--output', help='also write the report here')
+    parser.add_argument('--replay', help='JSONL recording to answer from')
+    parser.add_argument('--tokens-per-s', type=float, default=400)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds to first token')
+    parser.add_argument('--scene-words', type=int,
+                        help='length of synthetic scenes, by default 300 '
+                             '(100 with --quick)')
+    args = parser.parse_args()
+    scene_words = args.scene_words or (100 if args.quick else 300)
+    responder = SyntheticResponder(scene_words=scene_words)
+
+    lines = []
+
+    def report(line=''):
+        print(line)
+        sys.stdout.flush()
+        lines.append(line)
+
+    bench_parsers(report, number=20 if args.quick else 200)
+    report()
+    bench_overhead(report, responder, args.replay)
+    report()
+    bench_stages(report, responder, args.replay, args.tokens_per_s,
+                 args.latency)
+    report()
+    if args.quick:
+        bench_scaling(report, responder, args.replay, args.tokens_per_s,
+                      args.latency, n_books=2, levels=[1, 2])
+    else:
+        bench_scaling(report, responder, args.replay, args.tokens_per_s,
+                      args.latency, n_books=8, levels=[1, 2, 4, 8])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
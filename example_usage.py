@@ -1,4 +1,5 @@
 from goat_storytelling_agent.storytelling_agent import StoryAgent
+from goat_storytelling_agent.sinks import FileSceneSink
 
 # Initialize StoryAgent with KoboldCpp
 writer = StoryAgent(
@@ -16,18 +17,15 @@ writer = StoryAgent(
 )
 
 # Example 1: Generate complete story
+# Scenes are written to the file as soon as each one is finished
 print("Generating complete story...")
-novel_scenes = writer.generate_story('treasure hunt in a jungle')
+n_scenes = 0
+for record in writer.iter_story('treasure hunt in a jungle',
+                                sink=FileSceneSink('generated_novel.txt')):
+    n_scenes += 1
+    print(f"\nFinished chapter {record['chapter']}, scene {record['scene']}")
 
-# Save results
-with open('generated_novel.txt', 'w', encoding='utf-8') as f:
-    for i, scene in enumerate(novel_scenes):
-        f.write(f"\n\n{'='*50}\n")
-        f.write(f"SCENE {i+1}\n")
-        f.write(f"{'='*50}\n\n")
-        f.write(scene)
-
-print(f"Generated {len(novel_scenes)} scenes. Saved to generated_novel.txt")
+print(f"Generated {n_scenes} scenes. Saved to generated_novel.txt")
 
 # Example 2: Step-by-step generation
 print("\n\nStep-by-step generation example:")
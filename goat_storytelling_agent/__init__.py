@@ -3,6 +3,24 @@
 __version__ = "0.0.2-koboldcpp"
 
 from .storytelling_agent import StoryAgent
+from .async_agent import AsyncStoryAgent
 from .plan import Plan
+from .backends import BackendPool
+from .cache import ResponseCache
+from .journal import BookJournal
+from .metrics import Metrics, JSONLMetricsWriter
+from .sinks import (SceneSink, FileSceneSink, JSONLSceneSink,
+                    CallbackSceneSink, TokenSink, SilentTokenSink,
+                    ConsoleTokenSink, FileTokenSink, CallbackTokenSink)
+from .scheduler import BatchScheduler
+from .scoring import SceneScorer
+from .tokens import TokenCounter, ContextBudget, GenerationBudgets
+from .transport import Transport
 
-__all__ = ['StoryAgent', 'Plan']
+__all__ = ['StoryAgent', 'AsyncStoryAgent', 'Plan', 'BatchScheduler',
+           'BackendPool', 'ResponseCache', 'BookJournal', 'SceneSink',
+           'FileSceneSink', 'JSONLSceneSink', 'CallbackSceneSink',
+           'TokenSink', 'SilentTokenSink', 'ConsoleTokenSink',
+           'FileTokenSink', 'CallbackTokenSink',
+           'TokenCounter', 'ContextBudget', 'GenerationBudgets', 'Transport', 'Metrics',
+           'JSONLMetricsWriter', 'SceneScorer']
@@ -0,0 +1,340 @@
+"""Asyncio front-end for StoryAgent."""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from goat_storytelling_agent import utils
+from goat_storytelling_agent.backends import affinity, book_affinity
+from goat_storytelling_agent.metrics import timed_stage
+from goat_storytelling_agent.storytelling_agent import StoryAgent
+
+
+class AsyncStoryAgent(StoryAgent):
+    """StoryAgent with awaitable stages
+
+    Streaming requests run on a bounded worker pool over the shared
+    pooled transport, so the event loop never blocks on a socket and up to
+    ``max_concurrency`` completions can be in flight against a KoboldCpp
+    started in multiuser mode. Independent requests, such as the per-act
+    scene breakdowns, are issued concurrently.
+
+    All synchronous StoryAgent methods keep working unchanged; the
+    awaitable variants carry an ``a`` prefix.
+
+    With ``chapter_chains`` above 1 agenerate_story writes several
+    chapters at once: the first scene of every chapter is written from
+    the plan and the chapter's scene list alone, the following scenes of
+    a chapter still see their previous scene. ``smooth_seams`` then
+    bridges every chapter boundary with a short continue_a_scene passage
+    leading from the previous chapter into the next one.
+
+    Parameters
+    ----------
+    max_concurrency : int, optional
+        Max number of requests in flight at the same time, by default 3
+    chapter_chains : int, optional
+        Max number of chapters written at the same time, by default 1
+        (every scene sees the previous one)
+    smooth_seams : bool, optional
+        Bridge chapter boundaries in parallel mode, by default False
+    seam_words : int, optional
+        Approximate length of a seam bridge in words, by default 150
+    **kwargs
+        Passed on to StoryAgent
+    """
+
+    def __init__(self, *args, max_concurrency=3, chapter_chains=1,
+                 smooth_seams=False, seam_words=150, **kwargs):
+        kwargs.setdefault('pool_size', max_concurrency)
+        super().__init__(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.chapter_chains = chapter_chains
+        self.smooth_seams = smooth_seams
+        self.seam_words = seam_words
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix='story-agent')
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        super().close()
+
+    async def _run(self, func, *args, **kwargs):
+        """Runs a blocking call on the worker pool, keeping context vars"""
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, func, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def aquery_chat(self, messages, retries=3, use_scene_options=False,
+                          use_cache=True, on_delta=None, monitors=None,
+                          stop=None, grammar=None, options=None):
+        return await self._run(self.query_chat, messages, retries=retries,
+                               use_scene_options=use_scene_options,
+                               use_cache=use_cache, on_delta=on_delta,
+                               monitors=monitors, stop=stop, grammar=grammar,
+                               options=options)
+
+    async def aquery_scene(self, messages, on_delta=None, use_cache=True):
+        return await self._run(self.query_scene, messages, on_delta=on_delta,
+                               use_cache=use_cache)
+
+    async def ainit_book_spec(self, topic):
+        return await self._run(self.init_book_spec, topic)
+
+    async def aenhance_book_spec(self, book_spec):
+        return await self._run(self.enhance_book_spec, book_spec)
+
+    async def acreate_plot_chapters(self, book_spec):
+        return await self._run(self.create_plot_chapters, book_spec)
+
+    async def aenhance_plot_chapters(self, book_spec, plan):
+        # Acts are enhanced one after another, each sees the previous result
+        return await self._run(self.enhance_plot_chapters, book_spec, plan)
+
+    @timed_stage('split_chapters_into_scenes')
+    async def asplit_chapters_into_scenes(self, plan, book_spec):
+        """Async split_chapters_into_scenes, all acts are requested at once"""
+        all_messages, act_chapters = self._act_scenes_messages(plan, book_spec)
+        results = await asyncio.gather(
+            *(self._run(self._query_act_scenes, messages, act_chapters[i])
+              for i, messages in enumerate(all_messages, start=1)))
+        for act, act_scenes in zip(plan, results):
+            act['act_scenes'] = act_scenes
+        self._parse_act_scenes(plan, act_chapters)
+        return all_messages, plan
+
+    async def aiter_chapter_scenes(self, plan, book_spec):
+        """Yields (ch_num, scenes) in chapter order while acts stream in
+
+        All act breakdowns are requested at once and parsed incrementally,
+        so a chapter is yielded as soon as its own breakdown is complete
+        and its scenes can be written while later chapters are still being
+        broken down (this needs ``max_concurrency`` above the number of
+        acts to start before the first act is done). Once every act has
+        finished, ``plan`` holds the same ``act_scenes`` and
+        ``chapter_scenes`` as after ``asplit_chapters_into_scenes``, with
+        already yielded chapters kept as they were yielded.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        all_messages, act_chapters = self._act_scenes_messages(plan, book_spec)
+        for act in plan:
+            act['chapter_scenes'] = {}
+
+        async def breakdown(i, act, messages):
+            def on_event(event):
+                # Runs on a worker thread
+                loop.call_soon_threadsafe(events.put_nowait, (i, event))
+
+            try:
+                act['act_scenes'] = await self._run(
+                    self._query_act_scenes, messages, act_chapters[i],
+                    on_event)
+            finally:
+                events.put_nowait((i, None))
+
+        tasks = [asyncio.ensure_future(breakdown(i, act, messages))
+                 for i, (act, messages) in enumerate(
+                     zip(plan, all_messages), start=1)]
+        order = [(i, ch_num) for i in sorted(act_chapters)
+                 for ch_num in act_chapters[i]]
+        streamed = {}
+        yielded = {}
+        done = set()
+        try:
+            while len(done) < len(tasks):
+                i, event = await events.get()
+                if event is None:
+                    done.add(i)
+                else:
+                    streamed[(i, event[1])] = event[2]
+                # Yield the next chapters in order once they are known
+                while order:
+                    i, ch_num = order[0]
+                    if (i, ch_num) not in streamed and i not in done:
+                        break
+                    order.pop(0)
+                    scenes = streamed.get((i, ch_num))
+                    if scenes:
+                        plan[i - 1]['chapter_scenes'][ch_num] = scenes
+                        yielded[(i, ch_num)] = scenes
+                        yield ch_num, scenes
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        self._parse_act_scenes(plan, act_chapters)
+        for (i, ch_num), scenes in yielded.items():
+            plan[i - 1]['chapter_scenes'][ch_num] = scenes
+        # Chapters the final parse found but the stream did not
+        for i, act in enumerate(plan, start=1):
+            for ch_num, scenes in list(act['chapter_scenes'].items()):
+                if (i, ch_num) not in yielded:
+                    yield ch_num, scenes
+
+    @timed_stage('write_a_scene')
+    async def awrite_a_scene(self, scene, sc_num, ch_num, plan,
+                             previous_scene=None, book_spec=None):
+        messages = self._scene_messages(
+            scene, sc_num, ch_num, plan, previous_scene,
+            self.prompt_engine.prev_scene_intro, book_spec=book_spec)
+        if self.scene_candidates > 1:
+            generated_scene = await self._abest_scene(messages, scene)
+        else:
+            generated_scene = await self.aquery_scene(messages)
+        generated_scene = self.prepare_scene_text(generated_scene)
+        if self.scene_target_words:
+            generated_scene = await self._aextend_scene(
+                scene, sc_num, ch_num, plan, generated_scene,
+                book_spec=book_spec)
+        return messages, generated_scene
+
+    async def _abest_scene(self, messages, scene):
+        """Async _best_scene, a wave's candidates share the worker pool"""
+        best = None
+        n_done = 0
+        for n_tries, wave in enumerate(self._candidate_waves()):
+            if n_tries:
+                self._count_retry('scene')
+            candidates = await asyncio.gather(
+                *(self.aquery_scene(messages, use_cache=n_done + i == 0)
+                  for i in range(wave)))
+            n_done += wave
+            best = self._pick_candidate(best, candidates, scene)
+            if best[0] >= self.candidate_threshold:
+                break
+        self._status(f"Picked scene candidate scoring {best[0]:.2f} "
+                     f"of {n_done} candidates")
+        return best[1]
+
+    async def _aextend_scene(self, scene, sc_num, ch_num, plan, text,
+                             book_spec=None):
+        """Async _extend_scene"""
+        for _ in range(self.max_scene_continuations):
+            if not text or len(text.split()) >= self.scene_target_words:
+                break
+            _, continuation = await self.acontinue_a_scene(
+                scene, sc_num, ch_num, plan, current_scene=text,
+                book_spec=book_spec)
+            if not continuation:
+                print(f"Warning: scene {sc_num} of chapter {ch_num} stopped "
+                      f"at {len(text.split())} of {self.scene_target_words} "
+                      f"words")
+                break
+            text = f'{text}\n\n{continuation}'
+        return text
+
+    @timed_stage('continue_a_scene')
+    async def acontinue_a_scene(self, scene, sc_num, ch_num,
+                                plan, current_scene=None, book_spec=None):
+        messages = self._scene_messages(
+            scene, sc_num, ch_num, plan, current_scene,
+            self.prompt_engine.cur_scene_intro, book_spec=book_spec)
+        generated_scene = await self.aquery_scene(messages)
+        generated_scene = self.prepare_scene_text(generated_scene)
+        return messages, generated_scene
+
+    async def agenerate_story(self, topic):
+        """Async generate_story"""
+        with affinity(topic):
+            return await self._agenerate_story(topic)
+
+    async def _agenerate_story(self, topic):
+        _, book_spec = await self.ainit_book_spec(topic)
+        _, book_spec = await self.aenhance_book_spec(book_spec)
+        _, plan = await self.acreate_plot_chapters(book_spec)
+        _, plan = await self.aenhance_plot_chapters(book_spec, plan)
+
+        if self.chapter_chains > 1:
+            return await self.awrite_chapters(plan, book_spec)
+
+        # Scenes are written while the remaining acts are broken down
+        form_text = []
+        async for ch_num, chapter in self.aiter_chapter_scenes(
+                plan, book_spec):
+            sc_num = 1
+            for scene in chapter:
+                previous_scene = form_text[-1] if form_text else None
+                _, generated_scene = await self.awrite_a_scene(
+                    scene, sc_num, ch_num, plan,
+                    previous_scene=previous_scene, book_spec=book_spec)
+                form_text.append(generated_scene)
+                sc_num += 1
+        return form_text
+
+    async def awrite_chapters(self, plan, book_spec):
+        """Writes all scenes as up to ``chapter_chains`` parallel chapters
+
+        Chapters are started as soon as their scene breakdown is known.
+
+        Returns
+        -------
+        List[str]
+            Generated scene texts in book order
+        """
+        chains = asyncio.Semaphore(self.chapter_chains)
+        book_key = book_affinity.get()
+
+        async def write_chapter(ch_num, chapter):
+            async with chains:
+                # Chains of one book may spread over several backends
+                with affinity((book_key, 'chapter', ch_num)):
+                    texts = []
+                    for sc_num, scene in enumerate(chapter, start=1):
+                        previous_scene = texts[-1] if texts else None
+                        _, generated_scene = await self.awrite_a_scene(
+                            scene, sc_num, ch_num, plan,
+                            previous_scene=previous_scene,
+                            book_spec=book_spec)
+                        texts.append(generated_scene)
+                    return texts
+
+        chapters = []
+        tasks = []
+        async for ch_num, chapter in self.aiter_chapter_scenes(
+                plan, book_spec):
+            chapters.append((ch_num, chapter))
+            tasks.append(asyncio.ensure_future(write_chapter(ch_num, chapter)))
+        results = await asyncio.gather(*tasks)
+
+        if self.smooth_seams:
+            seams = [self.asmooth_seam(chapter[0], ch_num, plan,
+                                       results[i - 1][-1], book_spec)
+                     for i, (ch_num, chapter) in enumerate(chapters)
+                     if i > 0 and results[i - 1] and results[i]]
+            bridges = iter(await asyncio.gather(*seams))
+            for i in range(1, len(results)):
+                if results[i - 1] and results[i]:
+                    bridge = next(bridges)
+                    if bridge:
+                        results[i][0] = bridge + '\n\n' + results[i][0]
+        return [text for texts in results for text in texts]
+
+    async def asmooth_seam(self, scene, ch_num, plan, previous_scene,
+                           book_spec=None):
+        """Short passage leading from previous_scene into a chapter's start
+
+        Parameters
+        ----------
+        scene : str
+            Description of the chapter's first scene
+        ch_num : int
+            Chapter number
+        plan : Dict
+            Dict with book plan
+        previous_scene : str
+            Last scene of the previous chapter
+        book_spec : str, optional
+            Book specification
+
+        Returns
+        -------
+        str
+            The first paragraphs of the bridge, about ``seam_words`` long
+        """
+        _, bridge = await self.acontinue_a_scene(
+            scene, 1, ch_num, plan, current_scene=previous_scene,
+            book_spec=book_spec)
+        return utils.first_paragraphs(bridge, self.seam_words)
@@ -0,0 +1,228 @@
+"""Pool of KoboldCpp backends with health checks and sticky routing."""
+import contextlib
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+
+from goat_storytelling_agent.transport import get_default_transport
+
+
+# Key (usually the book) whose requests should stick to one backend
+book_affinity = contextvars.ContextVar('book_affinity', default=None)
+
+ROUTING_STRATEGIES = ['least_outstanding', 'weighted']
+
+
+@contextlib.contextmanager
+def affinity(key):
+    """Routes all requests made inside the block to the same backend"""
+    token = book_affinity.set(key)
+    try:
+        yield
+    finally:
+        book_affinity.reset(token)
+
+
+class Backend:
+    """Single KoboldCpp endpoint and its routing state"""
+
+    def __init__(self, uri, weight=1):
+        self.uri = uri.rstrip('/')
+        self.weight = weight
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.opens = 0
+        self.open_until = None
+        self.current_weight = 0
+
+    @property
+    def root(self):
+        """Server root without the OpenAI compatible /v1 suffix"""
+        if self.uri.endswith('/v1'):
+            return self.uri[:-3]
+        return self.uri
+
+    def __repr__(self):
+        state = 'up' if self.healthy else 'down'
+        return f'Backend({self.uri!r}, weight={self.weight}, {state})'
+
+
+class BackendPool:
+    """Routes requests over several KoboldCpp endpoints
+
+    Requests carrying the same affinity key (see ``affinity``) go to the
+    same backend as long as it is healthy, so consecutive scene requests
+    of one book reuse that server's context and KV cache. Other requests
+    are routed by least outstanding requests relative to weight, or by
+    smooth weighted round robin.
+
+    Every backend has a circuit breaker: after ``failure_threshold``
+    consecutive failed requests it opens, the backend leaves the rotation
+    and its sticky books fail over to the remaining ones. Once the open
+    period is over the backend is health checked, and it rejoins if the
+    check passes. The open period starts at ``recheck_interval`` seconds
+    and doubles each time the breaker opens again without a successful
+    request in between, up to ``max_recheck_interval``. Only the
+    ``max_sticky`` most recently used affinity keys are remembered.
+
+    Parameters
+    ----------
+    uris : str or List[str]
+        OpenAI compatible endpoints, e.g. http://host:5001/v1
+    weights : List[float], optional
+        Relative capacity of every endpoint, by default all equal
+    strategy : str, optional
+        'least_outstanding' or 'weighted', by default 'least_outstanding'
+    failure_threshold : int, optional
+        Consecutive failures that open the breaker, by default 1
+    recheck_interval : float, optional
+        Seconds before a failed backend is health checked again,
+        by default 30
+    max_recheck_interval : float, optional
+        Upper bound of the growing open period, by default 600
+    transport : Transport, optional
+        Transport used for health checks
+    max_sticky : int, optional
+        Number of affinity keys kept, by default 1024
+    """
+
+    def __init__(self, uris, weights=None, strategy='least_outstanding',
+                 failure_threshold=1, recheck_interval=30,
+                 max_recheck_interval=600, transport=None, max_sticky=1024):
+        if isinstance(uris, str):
+            uris = [uris]
+        if not uris:
+            raise ValueError('At least one backend uri is required')
+        if weights is None:
+            weights = [1] * len(uris)
+        if len(weights) != len(uris):
+            raise ValueError('Number of weights must match number of uris')
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(
+                f"Routing strategy must be one of {ROUTING_STRATEGIES}, "
+                f"got '{strategy}'")
+        self.backends = [Backend(uri, weight)
+                         for uri, weight in zip(uris, weights)]
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.recheck_interval = recheck_interval
+        self.max_recheck_interval = max_recheck_interval
+        self.transport = transport
+        self.max_sticky = max_sticky
+        self._sticky = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.backends)
+
+    def check_health(self, backend, timeout=5):
+        """Probes a backend, updates and returns its health"""
+        transport = self.transport or get_default_transport()
+        try:
+            response = transport.get(f'{backend.root}/api/v1/model',
+                                     timeout=timeout)
+            healthy = response.status_code == 200
+        except Exception:
+            healthy = False
+        with self._lock:
+            if healthy:
+                backend.healthy = True
+                backend.failures = 0
+                backend.open_until = None
+            else:
+                self._mark_down(backend)
+        return healthy
+
+    def check_all(self):
+        """Probes all backends, returns the healthy ones"""
+        return [backend for backend in self.backends
+                if self.check_health(backend)]
+
+    def _mark_down(self, backend):
+        backend.healthy = False
+        backend.opens += 1
+        open_for = min(self.max_recheck_interval,
+                       self.recheck_interval * 2 ** (backend.opens - 1))
+        backend.open_until = time.monotonic() + open_for
+        # Sticky books fail over on their next request
+        for key in [key for key, value in self._sticky.items()
+                    if value is backend]:
+            del self._sticky[key]
+
+    def _recheck_down(self):
+        now = time.monotonic()
+        due = [backend for backend in self.backends
+               if not backend.healthy and now >= backend.open_until]
+        for backend in due:
+            self.check_health(backend)
+
+    def _route(self, candidates):
+        if self.strategy == 'weighted':
+            total = sum(backend.weight for backend in candidates)
+            for backend in candidates:
+                backend.current_weight += backend.weight
+            chosen = max(candidates, key=lambda b: b.current_weight)
+            chosen.current_weight -= total
+            return chosen
+        return min(candidates,
+                   key=lambda b: ((b.outstanding + 1) / b.weight, -b.weight))
+
+    def acquire(self, affinity_key=None):
+        """Picks a backend for one request and counts it as outstanding
+
+        Parameters
+        ----------
+        affinity_key : hashable, optional
+            Sticky routing key, by default the current ``book_affinity``
+
+        Returns
+        -------
+        Backend
+            Backend to send the request to; pass it to ``release``
+        """
+        if affinity_key is None:
+            affinity_key = book_affinity.get()
+        self._recheck_down()
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy]
+            if not candidates:
+                # Everything is down: try the one that reopens first
+                candidates = [min(self.backends, key=lambda b: b.open_until)]
+            backend = None
+            if affinity_key is not None:
+                backend = self._sticky.get(affinity_key)
+            if backend is None or backend not in candidates:
+                backend = self._route(candidates)
+            if affinity_key is not None:
+                self._sticky[affinity_key] = backend
+                self._sticky.move_to_end(affinity_key)
+                while len(self._sticky) > self.max_sticky:
+                    self._sticky.popitem(last=False)
+            backend.outstanding += 1
+        return backend
+
+    def release_slot(self, backend):
+        """Marks a request as finished without touching the breaker
+
+        For requests that say nothing about generation health, such as
+        token counts.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+
+    def release(self, backend, ok=True):
+        """Marks a request as finished, counts failures for the breaker"""
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+                backend.opens = 0
+                return
+            backend.failures += 1
+            if backend.healthy and backend.failures >= self.failure_threshold:
+                if len(self.backends) > 1:
+                    print(f'Warning: backend {backend.uri} failed, '
+                          f'failing over')
+                self._mark_down(backend)
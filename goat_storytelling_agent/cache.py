@@ -0,0 +1,138 @@
+"""Persistent on-disk cache of chat completions."""
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class ResponseCache:
+    """Stores completions on disk keyed on the exact request
+
+    The key covers the messages, max_tokens and the merged sampler
+    options, so re-running a pipeline after a crash or a parser fix
+    replays the already paid for completions instead of querying the
+    backend again. Every entry is a small JSON file written atomically;
+    the least recently used entries are evicted once the cache grows past
+    ``max_entries`` or ``max_bytes``, and entries older than ``max_age``
+    seconds are ignored.
+
+    Parameters
+    ----------
+    path : str
+        Cache directory, created if missing
+    max_entries : int, optional
+        Max number of cached completions, by default unlimited
+    max_bytes : int, optional
+        Max total size of the cache directory, by default unlimited
+    max_age : float, optional
+        Max entry age in seconds, by default unlimited
+    cache_sampled : bool, optional
+        Also cache requests with non-deterministic sampling
+        (temperature > 0 and top_k != 1), by default True. Switch it off
+        when re-runs are supposed to produce new variants.
+    """
+
+    def __init__(self, path, max_entries=None, max_bytes=None, max_age=None,
+                 cache_sampled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def make_key(messages, max_tokens, options):
+        request = {'messages': messages, 'max_tokens': max_tokens,
+                   'options': options}
+        dump = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def is_deterministic(options):
+        return (options.get('temperature', 1) == 0
+                or options.get('top_k') == 1)
+
+    def accepts(self, options):
+        """Whether requests with these sampler options are cached"""
+        return self.cache_sampled or self.is_deterministic(options)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    def get(self, key):
+        """Returns the cached completion or None"""
+        fpath = self._entry_path(key)
+        try:
+            with open(fpath, encoding='utf-8') as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if self.max_age is not None and (
+                time.time() - entry.get('created', 0) > self.max_age):
+            self._remove(fpath)
+            self.misses += 1
+            return None
+        # mtime tracks last use for LRU eviction
+        try:
+            os.utime(fpath)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry['result']
+
+    def set(self, key, result):
+        fpath = self._entry_path(key)
+        tmp_path = f'{fpath}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump({'created': time.time(), 'result': result}, fp,
+                      ensure_ascii=False)
+        os.replace(tmp_path, fpath)
+        if self.max_entries is not None or self.max_bytes is not None:
+            self.evict()
+
+    @staticmethod
+    def _remove(fpath):
+        try:
+            os.remove(fpath)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Drops expired and least recently used entries over the limits"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort()
+            now = time.time()
+            total_bytes = sum(size for _, size, _ in entries)
+            n_entries = len(entries)
+            for mtime, size, fpath in entries:
+                expired = (self.max_age is not None
+                           and now - mtime > self.max_age)
+                too_many = (self.max_entries is not None
+                            and n_entries > self.max_entries)
+                too_big = (self.max_bytes is not None
+                           and total_bytes > self.max_bytes)
+                if not (expired or too_many or too_big):
+                    continue
+                self._remove(fpath)
+                n_entries -= 1
+                total_bytes -= size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.json'):
+                self._remove(entry.path)
@@ -0,0 +1,77 @@
+"""Append-only per-book journal used to checkpoint and resume generation."""
+import os
+import json
+
+
+class BookJournal:
+    """Records every finished stage of a book as one JSON line
+
+    Each record is flushed and fsynced before generation goes on, so a
+    crash or a kill loses at most the request that was running. A torn
+    last line left by a kill mid-write is ignored when loading.
+
+    Records are ``topic``, ``book_spec``, ``plan`` (enhanced, before the
+    scene breakdown), ``act_scenes`` (raw breakdown of one act),
+    ``scene`` (text of one finished scene) and ``invalidate`` (scenes
+    dropped again, e.g. after a plan edit, see StoryAgent.regenerate).
+
+    Parameters
+    ----------
+    path : str
+        Journal file, created on first write
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, record_type, **data):
+        record = {'type': record_type, **data}
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with open(self.path, 'ab+') as fp:
+            # Terminates a torn line left by a kill so it stays separate
+            if fp.seek(0, os.SEEK_END) > 0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    line = '\n' + line
+            fp.write(line.encode('utf-8'))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    @staticmethod
+    def empty_state():
+        return {'topic': None, 'book_spec': None, 'plan': None,
+                'act_scenes': {}, 'scenes': {}}
+
+    def load(self):
+        """Replays the journal
+
+        Returns
+        -------
+        dict
+            topic, book_spec and plan (None if not reached yet),
+            act_scenes as {act_num: text} and scenes as
+            {(ch_num, sc_num): text}
+        """
+        state = self.empty_state()
+        if not os.path.exists(self.path):
+            return state
+        with open(self.path, encoding='utf-8') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f'Warning: skipping damaged journal line in '
+                          f'{self.path}')
+                    continue
+                record_type = record.get('type')
+                if record_type in ('topic', 'book_spec', 'plan'):
+                    key = 'text' if record_type == 'book_spec' else record_type
+                    state[record_type] = record[key]
+                elif record_type == 'act_scenes':
+                    state['act_scenes'][record['act']] = record['text']
+                elif record_type == 'scene':
+                    state['scenes'][(record['ch'], record['sc'])] = record['text']
+                elif record_type == 'invalidate':
+                    for ch_num, sc_num in record['scenes']:
+                        state['scenes'].pop((ch_num, sc_num), None)
+        return state
@@ -0,0 +1,190 @@
+"""Per-request and per-stage metrics with hook callbacks and exporters."""
+import os
+import json
+import time
+import asyncio
+import threading
+import functools
+import contextvars
+from collections import defaultdict
+
+
+# Pipeline stage the current request belongs to
+current_stage = contextvars.ContextVar('current_stage', default=None)
+
+# Stage names the StoryAgent methods run their requests under
+PIPELINE_STAGES = (
+    'init_book_spec', 'enhance_book_spec', 'create_plot_chapters',
+    'enhance_plot_chapters', 'split_chapters_into_scenes', 'summarize_acts',
+    'write_a_scene', 'continue_a_scene',
+)
+
+# Per-stage counters: name, Prometheus type, help text
+STAGE_COUNTERS = [
+    ('requests', 'counter', 'Chat completion requests'),
+    ('cache_hits', 'counter', 'Requests answered from the response cache'),
+    ('failures', 'counter', 'Requests that returned no output'),
+    ('retries', 'counter', 'Extra attempts after transport errors'),
+    ('parse_retries', 'counter', 'Requests repeated for unusable answers'),
+    ('prompt_chars', 'counter', 'Characters of prompt sent'),
+    ('completion_tokens', 'counter', 'Streamed completion tokens'),
+    ('bytes_streamed', 'counter', 'Bytes of response stream read'),
+    ('latency_seconds', 'counter', 'Total request latency'),
+    ('ttft_seconds', 'counter', 'Total time to first token'),
+    ('generation_seconds', 'counter', 'Total time after the first token'),
+    ('stage_calls', 'counter', 'Completed stage calls'),
+    ('stage_seconds', 'counter', 'Wall time spent in the stage'),
+]
+
+
+class Metrics:
+    """Collects request and stage metrics of one or more agents
+
+    Every finished request produces a record dict with ``stage``,
+    ``backend``, ``prompt_chars``, ``cache_hit``, ``ok``, ``attempts``,
+    ``ttft`` and ``latency`` (seconds), ``completion_tokens``,
+    ``tokens_per_s`` and ``bytes_streamed``; every finished stage call a
+    record with ``stage`` and ``seconds``. Records go to the hooks
+    (``type`` is 'request' or 'stage') and are summed per stage.
+
+    Parameters
+    ----------
+    hooks : List[Callable[[dict], None]], optional
+        Called with every record, e.g. JSONLMetricsWriter
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.stages = defaultdict(lambda: dict.fromkeys(
+            (name for name, _, _ in STAGE_COUNTERS), 0))
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _emit(self, record):
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                print(f'Warning: metrics hook failed: {e}')
+
+    def record_request(self, record):
+        record = {'type': 'request', 'time': time.time(),
+                  'stage': current_stage.get(), **record}
+        generation = None
+        if record.get('ttft') is not None:
+            generation = record['latency'] - record['ttft']
+        record['tokens_per_s'] = None
+        if generation and record.get('completion_tokens'):
+            record['tokens_per_s'] = record['completion_tokens'] / generation
+        with self._lock:
+            stage = self.stages[record['stage']]
+            stage['requests'] += 1
+            stage['cache_hits'] += bool(record.get('cache_hit'))
+            stage['failures'] += not record.get('ok', True)
+            stage['retries'] += max(record.get('attempts', 1) - 1, 0)
+            stage['prompt_chars'] += record.get('prompt_chars', 0)
+            stage['completion_tokens'] += record.get('completion_tokens', 0)
+            stage['bytes_streamed'] += record.get('bytes_streamed', 0)
+            stage['latency_seconds'] += record.get('latency', 0)
+            stage['ttft_seconds'] += record.get('ttft') or 0
+            stage['generation_seconds'] += generation or 0
+        self._emit(record)
+
+    def record_retry(self, stage=None):
+        """Counts a request repeated because its answer was unusable"""
+        stage = stage or current_stage.get()
+        with self._lock:
+            self.stages[stage]['parse_retries'] += 1
+        self._emit({'type': 'retry', 'time': time.time(), 'stage': stage})
+
+    def record_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage]['stage_calls'] += 1
+            self.stages[stage]['stage_seconds'] += seconds
+        self._emit({'type': 'stage', 'time': time.time(), 'stage': stage,
+                    'seconds': seconds})
+
+    def summary(self):
+        """Per-stage totals as {stage: {counter: value}}"""
+        with self._lock:
+            return {stage: dict(values)
+                    for stage, values in self.stages.items()}
+
+    def to_prometheus(self, prefix='story_agent'):
+        """Per-stage totals in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = []
+        for name, kind, help_text in STAGE_COUNTERS:
+            metric = f'{prefix}_{name}_total'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for stage, values in sorted(summary.items(),
+                                        key=lambda item: str(item[0])):
+                label = json.dumps(stage or 'other')
+                lines.append(f'{metric}{{stage={label}}} {values[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='story_agent'):
+        """Writes to_prometheus atomically, e.g. for a textfile collector"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+
+class JSONLMetricsWriter:
+    """Metrics hook appending every record as a JSON line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._fp.write(line + '\n')
+            self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+def timed_stage(name):
+    """Decorator running an agent method as pipeline stage ``name``
+
+    Requests made inside are labelled with the stage and the call's wall
+    time is recorded in the agent's ``metrics``. A stage called from
+    within itself is only timed once.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                if current_stage.get() == name:
+                    return await func(self, *args, **kwargs)
+                token = current_stage.set(name)
+                start = time.perf_counter()
+                try:
+                    return await func(self, *args, **kwargs)
+                finally:
+                    current_stage.reset(token)
+                    self.metrics.record_stage(
+                        name, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if current_stage.get() == name:
+                return func(self, *args, **kwargs)
+            token = current_stage.set(name)
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                current_stage.reset(token)
+                self.metrics.record_stage(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
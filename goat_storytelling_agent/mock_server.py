@@ -0,0 +1,362 @@
+"""Local stand-in for KoboldCpp's OpenAI compatible API, for offline runs."""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+
+_token_re = re.compile(r'\S+\s*|\s+')
+
+_vocabulary = (
+    "the a his her their old new quiet narrow wet bright dark cold warm "
+    "city river street market temple house room window door table phone "
+    "money secret letter photo bag car boat train bridge rain night "
+    "morning evening light shadow voice face hand eye smile silence "
+    "walked looked waited turned opened closed said asked answered "
+    "remembered noticed followed crossed lied hid counted watched "
+    "slowly carefully again almost never already still only suddenly "
+    "Somchai Nok Arun Mali Kittisak Pim Bangkok Chiang Mai Phuket").split()
+
+
+def stream_tokens(text):
+    """Splits text into the pieces streamed as tokens, roughly words"""
+    return _token_re.findall(text)
+
+
+def request_key(messages):
+    """Replay key of a request, only the messages are taken into account"""
+    dump = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+
+class SyntheticResponder:
+    """Answers every pipeline stage with plausible, parseable text
+
+    The answers follow the formats the prompts ask for, so a whole
+    StoryAgent pipeline runs against it; requests carrying a ``grammar``
+    get the structured output JSON instead. Answers are deterministic for
+    a given prompt.
+
+    Parameters
+    ----------
+    chapters_per_act : int, optional
+        Chapters of every act, by default 2
+    scenes_per_chapter : int, optional
+        Scenes of every chapter, by default 2
+    scene_words : int, optional
+        Length of every scene, by default 600
+    """
+    spec_fields = ['Genre', 'Place', 'Time', 'Theme', 'Tone',
+                   'Point of View', 'Characters', 'Premise']
+    scene_fields = ['Characters', 'Place', 'Time', 'Event', 'Conflict',
+                    'Story value', 'Story value charge', 'Mood', 'Outcome']
+
+    def __init__(self, chapters_per_act=2, scenes_per_chapter=2,
+                 scene_words=600):
+        self.chapters_per_act = chapters_per_act
+        self.scenes_per_chapter = scenes_per_chapter
+        self.scene_words = scene_words
+
+    def _words(self, rng, n):
+        return ' '.join(rng.choice(_vocabulary) for _ in range(n))
+
+    def _chapters(self, act_num):
+        first = (act_num - 1) * self.chapters_per_act + 1
+        return list(range(first, first + self.chapters_per_act))
+
+    def _spec(self, rng, fields, structured):
+        spec = {field: self._words(rng, 8) for field in fields}
+        if structured:
+            return json.dumps(spec)
+        return '\n'.join(f'{field}: {value}' for field, value in spec.items())
+
+    def _act(self, rng, act_num, structured):
+        act_descr = self._words(rng, 10)
+        chapters = [self._words(rng, 12) for _ in self._chapters(act_num)]
+        if structured:
+            return {'act_descr': act_descr, 'chapters': chapters}
+        lines = [f'Act {act_num}: {act_descr}']
+        lines.extend(f'- Chapter {ch_num}: {chapter}' for ch_num, chapter
+                     in zip(self._chapters(act_num), chapters))
+        return '\n'.join(lines)
+
+    def _scenes(self, rng, act_num, structured):
+        chapters = []
+        for ch_num in self._chapters(act_num):
+            scenes = [{field: self._words(rng, 6)
+                       for field in self.scene_fields}
+                      for _ in range(self.scenes_per_chapter)]
+            chapters.append({'chapter': ch_num, 'scenes': scenes})
+        if structured:
+            return json.dumps({'chapters': chapters})
+        lines = []
+        for chapter in chapters:
+            for sc_num, scene in enumerate(chapter['scenes'], start=1):
+                lines.append(f"Chapter {chapter['chapter']}:")
+                lines.append(f'Scene {sc_num}:')
+                lines.extend(f'{field}: {value}'
+                             for field, value in scene.items())
+        return '\n'.join(lines)
+
+    def _scene(self, rng):
+        paragraphs = []
+        n_words = 0
+        while n_words < self.scene_words:
+            length = rng.randint(40, 80)
+            paragraphs.append(self._words(rng, length).capitalize() + '.')
+            n_words += length
+        return '\n\n'.join(paragraphs)
+
+    def __call__(self, data):
+        messages = data.get('messages', [])
+        prompt = messages[-1]['content'] if messages else ''
+        structured = bool(data.get('grammar'))
+        rng = random.Random(request_key(messages))
+        act_match = re.search(r'\bAct (\d+)', prompt)
+        act_num = int(act_match.group(1)) if act_match else 1
+        if 'fill the missing field:' in prompt:
+            field = prompt.split('fill the missing field:')[1].split('.')[0]
+            return f'{field.strip()}: {self._words(rng, 8)}'
+        if 'fill the missing fields:' in prompt:
+            fields = [field for field in self.spec_fields if
+                      f'\n{field}: value' in prompt]
+            return self._spec(rng, fields, structured)
+        if ('come up with a specification' in prompt
+                or 'Make the specification' in prompt):
+            return self._spec(rng, self.spec_fields, structured)
+        if prompt.startswith('Summarize this act'):
+            return self._words(rng, 40) + '.'
+        if prompt.startswith('Take Act'):
+            act = self._act(rng, act_num, structured)
+            return json.dumps(act) if structured else act
+        if 'Come up with a plot' in prompt:
+            acts = [self._act(rng, i, structured) for i in (1, 2, 3)]
+            if structured:
+                return json.dumps({'acts': acts})
+            return '\n\n'.join(acts)
+        if prompt.startswith('Break each chapter'):
+            return self._scenes(rng, act_num, structured)
+        return self._scene(rng)
+
+
+class MockKoboldServer:
+    """Serves /v1/chat/completions the way KoboldCpp streams it
+
+    Responses are replayed from a recording when one matches the request's
+    messages and synthesised by ``responder`` otherwise. With ``upstream``
+    set, unmatched requests are forwarded to a real KoboldCpp instead and
+    the answers are appended to ``record``, so a live session can be
+    replayed offline later.
+
+    Streaming speed is simulated: the first token waits ``latency`` plus
+    the prompt length over ``prompt_chars_per_s``, the following tokens
+    arrive at ``tokens_per_s``. With neither set, answers stream as fast
+    as the client reads them. /api/v1/model and /api/extra/tokencount
+    are served as well. With ``drop_after`` set, the first ``drops``
+    streamed answers break off after that many tokens, as a crashed or
+    restarted server would.
+
+    Parameters
+    ----------
+    host : str, optional
+        Interface to listen on, by default 127.0.0.1
+    port : int, optional
+        Port, by default a free one
+    responder : Callable[[dict], str], optional
+        Builds the answer from the request body, by default a
+        SyntheticResponder
+    tokens_per_s : float, optional
+        Generation speed, by default unlimited
+    latency : float, optional
+        Seconds before the first token, by default 0
+    prompt_chars_per_s : float, optional
+        Prompt processing speed, by default unlimited
+    replay : str, optional
+        JSONL recording to answer from
+    record : str, optional
+        JSONL file to append forwarded requests to
+    upstream : str, optional
+        Real OpenAI compatible endpoint, e.g. http://gpu-box:5001/v1
+    drop_after : int, optional
+        Tokens after which a streamed answer breaks off
+    drops : int, optional
+        Number of answers broken off, by default 1
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, responder=None,
+                 tokens_per_s=None, latency=0.0, prompt_chars_per_s=None,
+                 replay=None, record=None, upstream=None, drop_after=None,
+                 drops=1):
+        self.responder = responder or SyntheticResponder()
+        self.tokens_per_s = tokens_per_s
+        self.latency = latency
+        self.prompt_chars_per_s = prompt_chars_per_s
+        self.record = record
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.recorded = {}
+        if replay is not None:
+            self.load(replay)
+        self.drop_after = drop_after
+        self.drops = drops
+        self.n_requests = 0
+        self.n_tokens = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def uri(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def load(self, path):
+        """Adds the answers of a JSONL recording"""
+        with open(path, encoding='utf-8') as fp:
+            for line in fp:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.recorded[entry['key']] = entry['text']
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _forward(self, data):
+        response = requests.post(f'{self.upstream}/chat/completions',
+                                 json={**data, 'stream': False}, timeout=600)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
+    def answer(self, data):
+        """Text of the completion for a request body"""
+        key = request_key(data.get('messages', []))
+        text = self.recorded.get(key)
+        if text is not None:
+            return text
+        if self.upstream is None:
+            return self.responder(data)
+        text = self._forward(data)
+        with self._lock:
+            self.recorded[key] = text
+            if self.record is not None:
+                with open(self.record, 'a', encoding='utf-8') as fp:
+                    fp.write(json.dumps({'key': key, 'text': text},
+                                        ensure_ascii=False) + '\n')
+        return text
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Every token is its own small write, Nagle would delay them
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body, status=200):
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, payload):
+                self.wfile.write(b'%x\r\n' % len(payload) + payload + b'\r\n')
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/api/v1/model':
+                    self._send_json({'result': 'mock/synthetic'})
+                else:
+                    self._send_json({'error': 'not found'}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length) or b'{}')
+                if self.path.rstrip('/') == '/api/extra/tokencount':
+                    n_tokens = len(stream_tokens(data.get('prompt', '')))
+                    self._send_json({'value': n_tokens})
+                    return
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json({'error': 'not found'}, status=404)
+                    return
+                try:
+                    text = server.answer(data)
+                except Exception as e:
+                    self._send_json({'error': str(e)}, status=502)
+                    return
+                tokens = stream_tokens(text)
+                tokens = tokens[:data.get('max_tokens') or len(tokens)]
+                drop = False
+                with server._lock:
+                    server.n_requests += 1
+                    if (server.drop_after is not None and server.drops > 0
+                            and data.get('stream')):
+                        server.drops -= 1
+                        tokens = tokens[:server.drop_after]
+                        drop = True
+                    server.n_tokens += len(tokens)
+                delay = server.latency
+                if server.prompt_chars_per_s:
+                    prompt_chars = sum(len(message.get('content', ''))
+                                       for message in data['messages'])
+                    delay += prompt_chars / server.prompt_chars_per_s
+                if not data.get('stream'):
+                    time.sleep(delay + (len(tokens) / server.tokens_per_s
+                                        if server.tokens_per_s else 0))
+                    self._send_json({'choices': [{
+                        'index': 0, 'finish_reason': 'stop',
+                        'message': {'role': 'assistant',
+                                    'content': ''.join(tokens)}}]})
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    if delay:
+                        time.sleep(delay)
+                    start = time.perf_counter()
+                    for i, token in enumerate(tokens):
+                        if server.tokens_per_s:
+                            # Paced against the start, sleeps do not drift
+                            wait = (start + i / server.tokens_per_s
+                                    - time.perf_counter())
+                            if wait > 0:
+                                time.sleep(wait)
+                        event = {'choices': [{'index': 0,
+                                              'delta': {'content': token}}]}
+                        self._chunk(f'data: {json.dumps(event)}\n\n'
+                                    .encode('utf-8'))
+                    if drop:
+                        # No terminating chunk, the client sees a broken
+                        # stream
+                        self.close_connection = True
+                        return
+                    self._chunk(b'data: [DONE]\n\n')
+                    self._chunk(b'')
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, e.g. a stream monitor
+                    self.close_connection = True
+
+        return Handler
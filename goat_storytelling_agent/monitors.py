@@ -0,0 +1,183 @@
+"""Stream monitors that can end a completion while it is streaming."""
+from collections import Counter, deque
+
+
+class StreamMonitor:
+    """Watches streamed content, ``feed`` returns True to stop the stream
+
+    A monitor instance serves one request at a time and is reset before
+    every attempt. Monitors that stop a stream because the output went
+    wrong set ``degenerate``; such output is not cached. ``cut`` gets the
+    text of a stream the monitor stopped and returns the part to keep.
+    """
+    degenerate = False
+
+    def reset(self):
+        self.degenerate = False
+
+    def feed(self, content):
+        raise NotImplementedError
+
+    def cut(self, text):
+        return text
+
+
+class SceneHeaderStop(StreamMonitor):
+    """Stops a scene as soon as the model starts writing the next one
+
+    Mirrors ``StoryAgent.prepare_scene_text``: header lines at the start of
+    the text (a 'Chapter ' line within the first 5 lines, then a 'Scene '
+    line within the following 5) are skipped, and the stream is stopped
+    at the first later line starting with 'Chapter ' or 'Scene ', which
+    prepare_scene_text would cut off anyway. Lines are counted from the
+    first non-blank character, as prepare_scene_text sees the stripped
+    text, and ``cut`` drops the started header line.
+    """
+    headers = ('Chapter ', 'Scene ')
+    n_head_lines = 5
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.line = ''
+        self.line_num = 0
+        self.head_lines = []
+        self.header_zone_end = None
+        self.checked = False
+        self.started = False
+        self.n_chars = 0
+        self.line_start = 0
+        self.stop_at = None
+
+    def _close_line(self):
+        if self.line_num < self.n_head_lines:
+            self.head_lines.append(self.line)
+            if self.line_num == self.n_head_lines - 1:
+                ch_ids = [i for i, line in enumerate(self.head_lines)
+                          if 'Chapter ' in line]
+                start = ch_ids[-1] + 1 if ch_ids else 0
+                self.header_zone_end = start + self.n_head_lines
+        self.line = ''
+        self.line_num += 1
+        self.checked = False
+
+    def _is_next_header(self):
+        if self.header_zone_end is None or self.line_num < self.header_zone_end:
+            return False
+        return self.line.startswith(self.headers)
+
+    def _stop(self):
+        self.stop_at = self.line_start
+        return True
+
+    def cut(self, text):
+        if self.stop_at is None:
+            return text
+        return text[:self.stop_at]
+
+    def feed(self, content):
+        if not self.started:
+            # Leading blank lines are stripped before prepare_scene_text
+            stripped = content.lstrip()
+            self.n_chars += len(content) - len(stripped)
+            if not stripped:
+                return False
+            self.started = True
+            self.line_start = self.n_chars
+            content = stripped
+        longest = max(len(header) for header in self.headers)
+        pieces = content.split('\n')
+        for i, piece in enumerate(pieces):
+            if i > 0:
+                if not self.checked and self._is_next_header():
+                    return self._stop()
+                self._close_line()
+                self.n_chars += 1
+                self.line_start = self.n_chars
+            self.n_chars += len(piece)
+            if self.line_num < self.n_head_lines:
+                # Never a stop point, kept whole for the header zone check
+                self.line += piece
+                continue
+            if self.checked:
+                continue
+            self.line += piece
+            # A line is decided once it is long enough to hold a header
+            if len(self.line) >= longest:
+                if self._is_next_header():
+                    return self._stop()
+                self.line = ''
+                self.checked = True
+        return False
+
+
+class RepetitionMonitor(StreamMonitor):
+    """Stops a completion that has started looping
+
+    Keeps the word n-grams of the last ``window`` words with their
+    counts; once at least ``min_words`` words arrived and the share of
+    n-grams in the window that occurred before exceeds ``max_repeated``,
+    the stream is stopped and ``degenerate`` is set. Every word costs a
+    constant number of dict updates however long the completion gets.
+
+    Parameters
+    ----------
+    n : int, optional
+        N-gram length in words, by default 4
+    window : int, optional
+        Number of most recent words considered, by default 200
+    max_repeated : float, optional
+        Share of repeated n-grams that counts as a loop, by default 0.4
+    min_words : int, optional
+        Words received before the first check, by default 100
+    """
+
+    def __init__(self, n=4, window=200, max_repeated=0.4, min_words=100):
+        self.n = n
+        self.window = window
+        self.max_repeated = max_repeated
+        self.min_words = min_words
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.word = ''
+        self.n_words = 0
+        self.last_words = deque(maxlen=self.n)
+        self.ngrams = deque()
+        self.counts = Counter()
+
+    def _add_word(self, word):
+        self.n_words += 1
+        self.last_words.append(word.lower())
+        if len(self.last_words) < self.n:
+            return False
+        ngram = tuple(self.last_words)
+        self.ngrams.append(ngram)
+        self.counts[ngram] += 1
+        if len(self.ngrams) > self.window:
+            old = self.ngrams.popleft()
+            self.counts[old] -= 1
+            if not self.counts[old]:
+                del self.counts[old]
+        if self.n_words < self.min_words:
+            return False
+        repeated = 1 - len(self.counts) / len(self.ngrams)
+        if repeated > self.max_repeated:
+            self.degenerate = True
+            return True
+        return False
+
+    def feed(self, content):
+        words = (self.word + content).split()
+        # The last piece may continue in the next delta
+        if content and not content[-1].isspace() and words:
+            self.word = words.pop()
+        else:
+            self.word = ''
+        for word in words:
+            if self._add_word(word):
+                return True
+        return False
@@ -3,12 +3,255 @@ import re
 import json
 
 
+_act_split_re = re.compile('\n.{0,5}?Act ')
+_chapter_split_re = re.compile(r'\n.{0,20}?Chapter .+:')
+_dash_chapter_split_re = re.compile(r'\n\s*-\s*Chapter \d+:')
+_act_num_re = re.compile(r'Act \d')
+
+
+class Scene:
+    """Scene of a chapter's breakdown, numbered within the chapter"""
+    __slots__ = ('number', 'text')
+
+    def __init__(self, number, text):
+        self.number = number
+        self.text = text
+
+    def __repr__(self):
+        return f'Scene({self.number}, {self.text[:30]!r})'
+
+
+class Chapter:
+    """Chapter of an act, numbered through the whole book
+
+    Changing the text invalidates the renderings of the Plan the act
+    belongs to.
+    """
+    __slots__ = ('number', '_text', 'act')
+
+    def __init__(self, text, act=None, number=None):
+        self._text = text
+        self.act = act
+        self.number = number
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        if self.act is not None:
+            self.act._changed()
+
+    @property
+    def scenes(self):
+        """Scenes of the chapter once the act is broken down"""
+        chapter_scenes = self.act.chapter_scenes if self.act else None
+        texts = (chapter_scenes or {}).get(self.number) or []
+        return [Scene(i, text) for i, text in enumerate(texts, start=1)]
+
+    def __repr__(self):
+        return f'Chapter({self.number}, {self.text[:30]!r})'
+
+
+class Act:
+    """Act record that also reads and writes like the act dicts of a plan
+
+    ``act['chapters']`` gives the chapter texts, ``act.chapters`` the
+    Chapter records. Changing the description, the chapters or a chapter's
+    text invalidates the renderings of the Plan the act belongs to.
+    """
+    __slots__ = ('number', '_act_descr', '_chapters', 'act_scenes',
+                 'chapter_scenes', 'extra', 'plan')
+    fields = ('act_descr', 'chapters', 'act_scenes', 'chapter_scenes')
+
+    def __init__(self, act_descr='', chapters=(), act_scenes=None,
+                 chapter_scenes=None, **extra):
+        self.number = None
+        self.plan = None
+        self._act_descr = act_descr
+        self._chapters = tuple(Chapter(text, self) for text in chapters)
+        self.act_scenes = act_scenes
+        self.chapter_scenes = chapter_scenes
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, act):
+        return cls(**act)
+
+    def _changed(self):
+        if self.plan is not None:
+            self.plan._changed()
+
+    @property
+    def act_descr(self):
+        return self._act_descr
+
+    @act_descr.setter
+    def act_descr(self, act_descr):
+        self._act_descr = act_descr
+        self._changed()
+
+    @property
+    def chapters(self):
+        return self._chapters
+
+    @chapters.setter
+    def chapters(self, chapters):
+        self._chapters = tuple(Chapter(text, self) for text in chapters)
+        self._changed()
+
+    def __getitem__(self, key):
+        if key == 'act_descr':
+            return self._act_descr
+        if key == 'chapters':
+            return tuple(chapter.text for chapter in self._chapters)
+        if key in ('act_scenes', 'chapter_scenes'):
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.fields:
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in (*self.fields, *self.extra) if key in self]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        act = dict(self.items())
+        act['chapters'] = list(act['chapters'])
+        if act.get('chapter_scenes') is not None:
+            act['chapter_scenes'] = dict(act['chapter_scenes'])
+        return act
+
+    def __eq__(self, other):
+        if isinstance(other, Act):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == {**other,
+                                      'chapters': list(other.get('chapters',
+                                                                 []))}
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f'Act({self.number}, {self._act_descr[:30]!r}, '
+                f'{len(self._chapters)} chapters)')
+
+
 class Plan:
+    """Book plan: a list of acts, each with its chapters
+
+    The static methods work on plain lists of act dicts as well as on Plan
+    instances. A Plan keeps typed Act/Chapter records with the global
+    chapter numbers assigned once, and memoises its text renderings until
+    an act is replaced or its description, chapters or chapter texts
+    change, so a plan rendered into every scene prompt is only built once.
+
+    Parameters
+    ----------
+    acts : List[Dict or Act], optional
+        Acts, e.g. as returned by ``Plan.parse_text_plan``
+    """
+    __slots__ = ('acts', '_renders', '_chapter_index')
+
+    def __init__(self, acts=()):
+        self.acts = [self._adopt(act) for act in acts]
+        self._changed()
+
+    def _adopt(self, act):
+        if not isinstance(act, Act):
+            act = Act.from_dict(act)
+        elif act.plan is not None and act.plan is not self:
+            act = Act.from_dict(act.to_dict())
+        act.plan = self
+        return act
+
+    def _changed(self):
+        self._renders = {}
+        self._chapter_index = {}
+        ch_num = 1
+        for i, act in enumerate(self.acts, start=1):
+            act.number = i
+            for chapter in act.chapters:
+                chapter.number = ch_num
+                self._chapter_index[ch_num] = chapter
+                ch_num += 1
+
+    def _render(self, key, func):
+        text = self._renders.get(key)
+        if text is None:
+            text = self._renders[key] = func()
+        return text
+
+    def __len__(self):
+        return len(self.acts)
+
+    def __iter__(self):
+        return iter(self.acts)
+
+    def __getitem__(self, index):
+        return self.acts[index]
+
+    def __setitem__(self, index, act):
+        self.acts[index].plan = None
+        self.acts[index] = self._adopt(act)
+        self._changed()
+
+    def append(self, act):
+        self.acts.append(self._adopt(act))
+        self._changed()
+
+    def __eq__(self, other):
+        if isinstance(other, (Plan, list)):
+            return (len(self) == len(other) and
+                    all(a == b for a, b in zip(self.acts, other)))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Plan({self.acts!r})'
+
+    def chapter(self, ch_num):
+        """Chapter record by global chapter number, None if there is none"""
+        return self._chapter_index.get(ch_num)
+
+    def to_list(self):
+        """Plain list of act dicts, as stored in journals and plan files"""
+        return [act.to_dict() for act in self.acts]
+
     @staticmethod
     def split_by_act(original_plan):
         """Split text plan into acts with improved error handling"""
         # removes only Act texts with newline prepended soemwhere near
-        acts = re.split('\n.{0,5}?Act ', original_plan)
+        acts = _act_split_re.split(original_plan)
         # remove random short garbage from re split
         acts = [text.strip() for text in acts[:]
                 if (text and (len(text.split()) > 3))]
@@ -35,14 +278,14 @@ class Plan:
     @staticmethod
     def parse_act(act):
         """Parse act into chapters with improved handling"""
-        act = re.split(r'\n.{0,20}?Chapter .+:', act.strip())
+        act = _chapter_split_re.split(act.strip())
         chapters = [text.strip() for text in act[1:]
                     if (text and (len(text.split()) > 3))]
         
         # If no chapters found, try alternative patterns
         if not chapters:
             # Try with dash prefix
-            act_alt = re.split(r'\n\s*-\s*Chapter \d+:', act[0])
+            act_alt = _dash_chapter_split_re.split(act[0])
             chapters = [text.strip() for text in act_alt[1:]
                         if (text and (len(text.split()) > 3))]
         
@@ -80,16 +323,20 @@ class Plan:
     @staticmethod
     def act_2_str(plan, act_num):
         """Convert specific act to string"""
+        if isinstance(plan, Plan):
+            text_plan, chs = plan._render(
+                ('act', act_num),
+                lambda: Plan._act_2_str(plan.acts, act_num))
+            return text_plan, list(chs)
+        return Plan._act_2_str(plan, act_num)
+
+    @staticmethod
+    def _act_2_str(plan, act_num):
         text_plan = ''
         chs = []
         ch_num = 1
         for i, act in enumerate(plan):
-            act_descr = act.get('act_descr', '')
-            if act_descr and not re.search(r'Act \d', act_descr[0:50]):
-                act_descr = f'Act {i+1}: ' + act_descr
-            elif not act_descr:
-                act_descr = f'Act {i+1}:'
-            act_descr += '\n'
+            act_descr = Plan._act_header(act, i) + '\n'
             
             for chapter in act.get('chapters', []):
                 if (i + 1) == act_num:
@@ -104,18 +351,19 @@ class Plan:
     @staticmethod
     def plan_2_str(plan):
         """Convert plan to string with error handling"""
+        if isinstance(plan, Plan):
+            return plan._render('plan', lambda: Plan._plan_2_str(plan.acts))
+        return Plan._plan_2_str(plan)
+
+    @staticmethod
+    def _plan_2_str(plan):
         if not plan:
             return "No plan available"
             
         text_plan = ''
         ch_num = 1
         for i, act in enumerate(plan):
-            act_descr = act.get('act_descr', '')
-            if act_descr and not re.search(r'Act \d', act_descr[0:50]):
-                act_descr = f'Act {i+1}: ' + act_descr
-            elif not act_descr:
-                act_descr = f'Act {i+1}:'
-            act_descr += '\n'
+            act_descr = Plan._act_header(act, i) + '\n'
             
             for chapter in act.get('chapters', []):
                 act_descr += f'- Chapter {ch_num}: {chapter}\n'
@@ -123,12 +371,272 @@ class Plan:
             text_plan += act_descr + '\n'
         return text_plan.strip()
 
+    @staticmethod
+    def _act_header(act, i):
+        act_descr = act.get('act_descr', '')
+        if act_descr and not _act_num_re.search(act_descr[0:50]):
+            act_descr = f'Act {i+1}: ' + act_descr
+        elif not act_descr:
+            act_descr = f'Act {i+1}:'
+        return act_descr
+
+    @staticmethod
+    def act_outline(plan, i):
+        """Act header and chapter list of the act at index i"""
+        def render():
+            act = plan[i]
+            return Plan._act_header(act, i) + '\n' + '\n'.join(
+                f'- {chapter}' for chapter in act.get('chapters', []))
+
+        if isinstance(plan, Plan):
+            return plan._render(('outline', i), render)
+        return render()
+
+    @staticmethod
+    def _first_sentence(text):
+        sentence, sep, rest = text.partition('. ')
+        return sentence + sep.strip()
+
+    @staticmethod
+    def window_2_str(plan, ch_num, window=1, summaries=None, budget=None):
+        """Convert plan to string focused on one chapter
+
+        The chapter and its ``window`` neighbours are kept in full, other
+        chapters of the same act are shortened to their first sentence,
+        neighbouring acts are replaced with their summary (or description)
+        and more distant acts with their description only. If ``budget``
+        (in words) is given, detail is dropped until the text fits.
+
+        Parameters
+        ----------
+        plan : List[Dict]
+            Book plan
+        ch_num : int
+            Global number of the current chapter
+        window : int, optional
+            Number of neighbouring chapters kept in full, by default 1
+        summaries : Dict[int, str], optional
+            Act summaries by act index (0-based)
+        budget : int, optional
+            Max number of words
+
+        Returns
+        -------
+        str
+            Plan text
+        """
+        if isinstance(plan, Plan):
+            key = ('window', ch_num, window, budget,
+                   tuple(sorted(summaries.items())) if summaries else None)
+            return plan._render(key, lambda: Plan._window_2_str(
+                plan.acts, ch_num, window, summaries, budget))
+        return Plan._window_2_str(plan, ch_num, window, summaries, budget)
+
+    @staticmethod
+    def _window_2_str(plan, ch_num, window, summaries, budget):
+        if not plan:
+            return "No plan available"
+        summaries = summaries or {}
+        # Global chapter numbers of every act
+        act_chs = []
+        first = 1
+        for act in plan:
+            n_chs = len(act.get('chapters', []))
+            act_chs.append(range(first, first + n_chs))
+            first += n_chs
+        cur_act = next((i for i, chs in enumerate(act_chs) if ch_num in chs),
+                       len(plan) - 1)
+
+        def render(window, same_act_others, adjacent_summaries, far_acts):
+            text_plan = ''
+            for i, act in enumerate(plan):
+                distance = abs(i - cur_act)
+                act_descr = Plan._act_header(act, i)
+                if distance > 1 and not far_acts:
+                    continue
+                if distance > 0:
+                    summary = summaries.get(i)
+                    if distance == 1 and adjacent_summaries and summary:
+                        act_descr = f'Act {i+1} summary: {summary}'
+                    elif distance > 1:
+                        act_descr = Plan._first_sentence(act_descr)
+                    text_plan += act_descr + '\n\n'
+                    continue
+                act_descr += '\n'
+                for num, chapter in zip(act_chs[i], act.get('chapters', [])):
+                    if abs(num - ch_num) <= window:
+                        act_descr += f'- Chapter {num}: {chapter}\n'
+                    elif same_act_others:
+                        act_descr += (f'- Chapter {num}: '
+                                      f'{Plan._first_sentence(chapter)}\n')
+                text_plan += act_descr + '\n'
+            return text_plan.strip()
+
+        # From the most to the least detailed variant
+        levels = [(window, True, True, True),
+                  (window, False, True, True),
+                  (window, False, False, False),
+                  (0, False, False, False)]
+        for level in levels:
+            text_plan = render(*level)
+            if budget is None or len(text_plan.split()) <= budget:
+                break
+        return text_plan
+
     @staticmethod
     def save_plan(plan, fpath):
         """Save plan to JSON file with error handling"""
+        if isinstance(plan, Plan):
+            plan = plan.to_list()
         try:
             with open(fpath, 'w', encoding='utf-8') as fp:
                 json.dump(plan, fp, indent=4, ensure_ascii=False)
             print(f"Plan saved to {fpath}")
         except Exception as e:
             print(f"Error saving plan: {e}")
+
+    @staticmethod
+    def load_plan(fpath):
+        """Load a plan saved with save_plan, None if it cannot be read"""
+        try:
+            with open(fpath, encoding='utf-8') as fp:
+                acts = json.load(fp)
+        except Exception as e:
+            print(f"Error loading plan: {e}")
+            return None
+        for act in acts:
+            # JSON turned the chapter numbers into strings
+            if act.get('chapter_scenes'):
+                act['chapter_scenes'] = {int(ch_num): scenes for ch_num, scenes
+                                         in act['chapter_scenes'].items()}
+        return Plan(acts)
+
+
+class PlanStreamParser:
+    """Incremental parser for a streamed by-chapter plan
+
+    Feed it the deltas of a create_plot_chapters/enhance_plot_chapters
+    completion; it returns events as soon as a block is closed by the
+    next header line: ``('act', act_num, act_descr)`` once an act's
+    description is complete and ``('chapter', act_num, chapter)`` once a
+    chapter is. Headers are recognised with the same patterns as
+    ``Plan.split_by_act`` and ``Plan.parse_act``; the full parse of the
+    finished text stays authoritative.
+    """
+    act_re = re.compile(r'.{0,5}?Act ')
+    chapter_re = re.compile(r'.{0,20}?Chapter .+:')
+
+    def __init__(self):
+        self.line = ''
+        self.act_num = 0
+        self.act_descr = None
+        self.chapter = None
+
+    def _close_block(self, events):
+        if self.chapter is not None:
+            chapter = self.chapter.strip()
+            if len(chapter.split()) > 3:
+                events.append(('chapter', self.act_num, chapter))
+            self.chapter = None
+        elif self.act_descr is not None:
+            events.append(('act', self.act_num, self.act_descr.strip()))
+            self.act_descr = None
+
+    def _process_line(self, line, events):
+        match = self.chapter_re.match(line)
+        if match and self.act_num:
+            self._close_block(events)
+            self.chapter = line[match.end():]
+        elif self.act_re.match(line):
+            self._close_block(events)
+            self.act_num += 1
+            self.act_descr = line.strip()
+        elif self.chapter is not None:
+            self.chapter += '\n' + line
+        elif self.act_descr is not None:
+            self.act_descr += '\n' + line
+
+    def feed(self, content):
+        events = []
+        lines = (self.line + content).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            self._process_line(line, events)
+        return events
+
+    def close(self):
+        events = []
+        if self.line:
+            self._process_line(self.line, events)
+            self.line = ''
+        self._close_block(events)
+        return events
+
+
+class SceneStreamParser:
+    """Incremental parser for a streamed per-act scene breakdown
+
+    Returns ``('chapter', ch_num, scenes)`` events as soon as the
+    breakdown moves on to another chapter, splitting chapters and scenes
+    exactly like ``StoryAgent.split_chapters_into_scenes`` does on the
+    finished text, so scene writing can start before the whole act is
+    broken down.
+
+    Parameters
+    ----------
+    ch_nums : List[int], optional
+        Chapters expected in the act, others are not reported
+    """
+    chapter_re = re.compile(r'Chapter (\d+)')
+    scene_re = re.compile(r'Scene \d+.{0,10}?:')
+
+    def __init__(self, ch_nums=None):
+        self.ch_nums = set(ch_nums) if ch_nums is not None else None
+        self.line = ''
+        self.ch_num = None
+        self.chapter = ''
+        self.piece = ''
+
+    def _emit_chapter(self, events):
+        if self.ch_num is None:
+            return
+        scenes = self.scene_re.split(self.chapter)
+        scenes = [text.strip() for text in scenes[1:]
+                  if (text and (len(text.split()) > 3))]
+        if scenes and (self.ch_nums is None or self.ch_num in self.ch_nums):
+            events.append(('chapter', self.ch_num, scenes))
+
+    def _process_line(self, line, events):
+        parts = self.chapter_re.split(line)
+        self.piece += parts[0]
+        for ch_num, text in zip(parts[1::2], parts[2::2]):
+            # Text between two chapter markers, joined like the full parse
+            if self.ch_num is not None:
+                self.chapter += self.piece.strip().lstrip(':')
+            self.piece = ''
+            if int(ch_num) != self.ch_num:
+                self._emit_chapter(events)
+                self.ch_num = int(ch_num)
+                self.chapter = ''
+            self.piece = text
+        self.piece += '\n'
+
+    def feed(self, content):
+        events = []
+        lines = (self.line + content).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            self._process_line(line, events)
+        return events
+
+    def close(self):
+        events = []
+        if self.line:
+            self._process_line(self.line, events)
+            self.line = ''
+        if self.ch_num is not None:
+            self.chapter += self.piece.strip().lstrip(':')
+        self.piece = ''
+        self._emit_chapter(events)
+        self.ch_num = None
+        return events
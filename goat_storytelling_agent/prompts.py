@@ -20,6 +20,9 @@ scene_spec_format = (
     "Chapter [number]:\nScene [number]:\nCharacters: character list\nPlace: place\nTime: absolute or relative time\nEvent: what happens\nConflict: scene micro-conflict\n"
     "Story value: story value affected by the scene\nStory value charge: the charge of story value by the end of the scene (positive or negative)\nMood: mood\nOutcome: the result.")
 
+scene_spec_fields = ['Characters', 'Place', 'Time', 'Event', 'Conflict',
+                     'Story value', 'Story value charge', 'Mood', 'Outcome']
+
 prev_scene_intro = "\n\nHere is the ending of the previous scene:\n"
 cur_scene_intro = "\n\nHere is the last written snippet of the current scene:\n"
 
@@ -48,6 +51,20 @@ def missing_book_spec_messages(field, text_spec):
     return messages
 
 
+def missing_book_spec_fields_messages(fields, text_spec):
+    fields_format = "\n".join(f"{field}: value" for field in fields)
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user",
+         "content": (
+            f"Given a hypothetical book spec, fill the missing fields: {', '.join(fields)}. "
+            f'Return only these fields, one per line like "Field: value":\n{fields_format}\n'
+            f'Book spec:\n"""{text_spec}"""')
+        }
+    ]
+    return messages
+
+
 def enhance_book_spec_messages(book_spec, form):
     messages = [
         {"role": "system", "content": system},
@@ -106,3 +123,54 @@ def scene_messages(scene, sc_num, ch_num, text_plan, form):
             f"Here is the scene specification:\n\"\"\"{scene}\"\"\"\n\nHere is the overall plot:\n\"\"\"{text_plan}\"\"\""},
     ]
     return messages
+
+
+def summarize_act_messages(text_act, form):
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": (
+            f"Summarize this act of a {form} plot in two or three sentences. Keep character names and the key events, drop minor details. "
+            "Do NOT use any markdown or any kind of special formatting (no **, *, #, ##, _, etc.)\n"
+            f"Act:\n\"\"\"{text_act}\"\"\"")}
+    ]
+    return messages
+
+
+def scene_messages_prefix(scene, sc_num, ch_num, text_plan, form,
+                          book_spec=None, chapter_scenes=None,
+                          snippet_intro=None, snippet=None):
+    """Scene request ordered from the most to the least stable content
+
+    Consecutive scene requests share everything up to the chapter context,
+    so the backend can reuse its processed prompt instead of evaluating
+    the plan again for every scene.
+    """
+    content = (
+        f"You will write long detailed scenes for a {form} based on the information below. "
+        "Be creative, explore interesting characters and unusual settings. Do NOT use foreshadowing. "
+        "Do NOT use any markdown or any kind of special formatting (no **, *, #, ##, _, etc.)\n")
+    if book_spec:
+        content += f"Here is the book specification:\n\"\"\"{book_spec}\"\"\"\n\n"
+    content += f"Here is the overall plot:\n\"\"\"{text_plan}\"\"\"\n\n"
+    if chapter_scenes:
+        chapter_plan = "\n".join(f"Scene {i}: {text}"
+                                 for i, text in enumerate(chapter_scenes, start=1))
+        content += f"Here are all scenes of chapter {ch_num}:\n\"\"\"{chapter_plan}\"\"\"\n\n"
+    content += (f"Now write scene {sc_num} in chapter {ch_num}. "
+                f"Here is the scene specification:\n\"\"\"{scene}\"\"\"")
+    if snippet:
+        content += f'{snippet_intro}"""{snippet}"""'
+    messages = [
+        {"role": "system", "content": 'You are an expert fiction writer. Write detailed scenes with lively dialogue. Do not use asterisks for formatting or emphasis.'},
+        {"role": "user", "content": content},
+    ]
+    return messages
+
+
+def structured_messages(messages, json_example):
+    """Asks for the answer of the last user message as JSON"""
+    messages = [dict(message) for message in messages]
+    messages[-1]['content'] += (
+        "\n\nAnswer with JSON only, exactly in this format "
+        "(fill in every \"...\"):\n" + json_example)
+    return messages
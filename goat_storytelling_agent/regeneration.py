@@ -0,0 +1,62 @@
+"""Works out what an edit of a generated book's plan invalidates."""
+from goat_storytelling_agent.plan import Plan
+
+
+def render_act_scenes(chapter_scenes):
+    """Scene breakdown of one act in the free-text format
+
+    The text is what ``StoryAgent.split_chapters_into_scenes`` stores as
+    ``act_scenes`` and parses back into the same ``chapter_scenes``.
+    """
+    lines = []
+    for ch_num, scenes in chapter_scenes.items():
+        for sc_num, scene in enumerate(scenes, start=1):
+            lines.append(f'Chapter {ch_num}:')
+            lines.append(f'Scene {sc_num}:')
+            lines.append(scene)
+    return '\n'.join(lines)
+
+
+def chapter_texts(plan):
+    """{ch_num: chapter text} with the book-wide chapter numbers"""
+    if not isinstance(plan, Plan):
+        plan = Plan(plan)
+    return {chapter.number: chapter.text
+            for act in plan for chapter in act.chapters}
+
+
+def tail_consumers(order, invalid, words, n_crop_previous,
+                   crop_across_scenes=False):
+    """Scenes whose previous-scene context came from an invalid scene
+
+    Parameters
+    ----------
+    order : List[Tuple[int, int]]
+        (ch_num, sc_num) of every scene in book order
+    invalid : Set[Tuple[int, int]]
+        Scenes that are written again
+    words : Dict[Tuple[int, int], int]
+        Word counts of the kept scenes
+    n_crop_previous : int
+        Words of context a scene gets from the ones before it
+    crop_across_scenes : bool, optional
+        Whether that context may reach back over several scenes
+
+    Returns
+    -------
+    Set[Tuple[int, int]]
+        Scenes following an invalid one that saw a part of its text
+    """
+    consumers = set()
+    for i, key in enumerate(order):
+        if key not in invalid:
+            continue
+        n_words = 0
+        for later in order[i + 1:]:
+            consumers.add(later)
+            if not crop_across_scenes or later in invalid:
+                break
+            n_words += words.get(later, 0)
+            if n_words >= n_crop_previous:
+                break
+    return consumers - set(invalid)
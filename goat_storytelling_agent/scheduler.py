@@ -0,0 +1,223 @@
+"""Batch scheduler that runs many books against one backend."""
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import threading
+import traceback
+from collections import Counter
+
+from goat_storytelling_agent.async_agent import AsyncStoryAgent
+from goat_storytelling_agent.backends import book_affinity
+
+
+# Job of the book currently being generated in this task/thread
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class BookJob:
+    """One book of a batch and the state of its stage graph"""
+
+    def __init__(self, job_id, topic, priority=0):
+        self.job_id = job_id
+        self.topic = topic
+        self.priority = priority
+        self.stage = None
+        self.book_spec = None
+        self.plan = None
+        self.scenes = []
+        self.error = None
+        self.done = False
+
+    def __repr__(self):
+        return (f'BookJob({self.job_id}, {self.topic!r}, '
+                f'priority={self.priority}, stage={self.stage})')
+
+
+class RequestGate:
+    """Bounds the number of requests in flight against the backend
+
+    Waiting requests are admitted by job priority (higher first); among
+    jobs of equal priority the one that got the fewest slots so far goes
+    first, so a book stuck in a long serial scene chain cannot starve the
+    others and vice versa. Requests made outside of a job count as one
+    job with priority 0.
+
+    Parameters
+    ----------
+    max_in_flight : int
+        Max number of requests running at the same time
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.served = Counter()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def _next_waiting(self):
+        return min(self._waiting,
+                   key=lambda entry: (-entry[0], self.served[entry[2]],
+                                      entry[1]))
+
+    @contextlib.contextmanager
+    def slot(self):
+        job = current_job.get()
+        key = job.job_id if job is not None else None
+        priority = job.priority if job is not None else 0
+        entry = (priority, next(self._seq), key)
+        with self._cond:
+            self._waiting.append(entry)
+            while (self.in_flight >= self.max_in_flight
+                   or self._next_waiting() is not entry):
+                self._cond.wait()
+            self._waiting.remove(entry)
+            self.in_flight += 1
+            self.served[key] += 1
+            # Someone else may be admitted too if slots are left
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+
+class BatchScheduler:
+    """Generates many books concurrently from a list of topics
+
+    Every book runs its stage graph (init_book_spec -> enhance_book_spec
+    -> create_plot_chapters -> enhance_plot_chapters ->
+    split_chapters_into_scenes -> scenes) as an independent job. Up to
+    ``max_active_books`` books progress at the same time while a shared
+    RequestGate keeps at most ``max_in_flight`` requests against the
+    backend, so the GPU stays busy while any single book waits on its
+    strictly sequential scene chain.
+
+    Parameters
+    ----------
+    agent : AsyncStoryAgent, optional
+        Agent used by all books, created from ``agent_kwargs`` if omitted
+    max_in_flight : int, optional
+        Max number of concurrent backend requests, by default 2
+    max_active_books : int, optional
+        Max number of books progressing at once, by default
+        ``agent.max_concurrency`` for a given agent, 4 otherwise
+    **agent_kwargs
+        Passed on to AsyncStoryAgent if no agent is given
+    """
+
+    def __init__(self, agent=None, max_in_flight=2, max_active_books=None,
+                 **agent_kwargs):
+        if agent is None:
+            max_active_books = max_active_books or 4
+            # One worker per book waiting on the gate plus the running ones
+            agent_kwargs.setdefault('max_concurrency',
+                                    max_active_books + max_in_flight)
+            agent = AsyncStoryAgent(**agent_kwargs)
+        self.agent = agent
+        self.gate = RequestGate(max_in_flight)
+        self.agent.request_gate = self.gate
+        self.max_active_books = max_active_books or agent.max_concurrency
+        self.jobs = []
+
+    def submit(self, topic, priority=0):
+        """Adds a book to the batch
+
+        Parameters
+        ----------
+        topic : str
+            Short initial topic
+        priority : int, optional
+            Higher priority books get backend slots first, by default 0
+
+        Returns
+        -------
+        BookJob
+            Job tracking the book's progress and results
+        """
+        job = BookJob(len(self.jobs), topic, priority=priority)
+        self.jobs.append(job)
+        return job
+
+    async def _run_job(self, job):
+        current_job.set(job)
+        book_affinity.set(('job', job.job_id))
+        agent = self.agent
+        try:
+            job.stage = 'init_book_spec'
+            _, book_spec = await agent.ainit_book_spec(job.topic)
+            job.stage = 'enhance_book_spec'
+            _, book_spec = await agent.aenhance_book_spec(book_spec)
+            job.book_spec = book_spec
+            job.stage = 'create_plot_chapters'
+            _, plan = await agent.acreate_plot_chapters(book_spec)
+            job.stage = 'enhance_plot_chapters'
+            _, plan = await agent.aenhance_plot_chapters(book_spec, plan)
+            job.stage = 'split_chapters_into_scenes'
+            _, plan = await agent.asplit_chapters_into_scenes(plan, book_spec)
+            job.plan = plan
+            job.stage = 'scenes'
+            for act in plan:
+                for ch_num, chapter in act['chapter_scenes'].items():
+                    for sc_num, scene in enumerate(chapter, start=1):
+                        previous_scene = job.scenes[-1] if job.scenes else None
+                        _, generated_scene = await agent.awrite_a_scene(
+                            scene, sc_num, ch_num, plan,
+                            previous_scene=previous_scene,
+                            book_spec=book_spec)
+                        job.scenes.append(generated_scene)
+            job.done = True
+        except Exception as e:
+            traceback.print_exc()
+            print(f'Error: book {job.job_id} failed at {job.stage}: {e}')
+            job.error = e
+        return job
+
+    async def run(self):
+        """Runs all submitted jobs, returns them in submission order"""
+        active = asyncio.Semaphore(self.max_active_books)
+        # Higher priority books are started first
+        pending = sorted(self.jobs, key=lambda job: -job.priority)
+
+        async def run_bounded(job):
+            async with active:
+                return await self._run_job(job)
+
+        tasks = [asyncio.ensure_future(run_bounded(job)) for job in pending]
+        await asyncio.gather(*tasks)
+        return self.jobs
+
+    def run_sync(self):
+        return asyncio.run(self.run())
+
+
+def generate_books(topics, max_in_flight=2, max_active_books=None,
+                   **agent_kwargs):
+    """Generates one book per topic with a BatchScheduler
+
+    Parameters
+    ----------
+    topics : List[str] or List[Tuple[str, int]]
+        Topics, optionally paired with a priority
+
+    Returns
+    -------
+    List[BookJob]
+        Finished jobs in the order of topics
+    """
+    scheduler = BatchScheduler(max_in_flight=max_in_flight,
+                               max_active_books=max_active_books,
+                               **agent_kwargs)
+    for topic in topics:
+        if isinstance(topic, (tuple, list)):
+            scheduler.submit(topic[0], priority=topic[1])
+        else:
+            scheduler.submit(topic)
+    try:
+        return scheduler.run_sync()
+    finally:
+        scheduler.agent.close()
@@ -0,0 +1,113 @@
+"""Cheap local quality scores used to pick between scene candidates."""
+import re
+from collections import Counter
+
+
+_word_re = re.compile(r"[\w']+")
+_split_re = re.compile(r',|;|\band\b|\(|\)')
+
+_stopwords = {'the', 'and', 'with', 'from', 'into', 'their', 'there',
+              'this', 'that', 'they', 'them', 'his', 'her', 'who', 'while',
+              'where', 'when', 'about', 'other', 'some', 'none'}
+
+
+class SceneScorer:
+    """Rates a generated scene between 0 and 1 without any model call
+
+    The score is a weighted mean of
+    ``length``: words against ``target_words`` (or ``min_words`` if no
+    target is set), overshooting the target costs too;
+    ``repetition``: share of n-grams that are not repeats;
+    ``truncation``: share of the raw completion that survived
+    ``StoryAgent.prepare_scene_text``;
+    ``keywords``: share of the names and places of the scene description
+    (its ``keyword_fields`` lines) that appear in the text.
+
+    Parameters
+    ----------
+    target_words : int, optional
+        Expected scene length in words
+    min_words : int, optional
+        Length counted as complete without a target, by default 300
+    n : int, optional
+        Length of the n-grams checked for repetition, by default 4
+    weights : Dict[str, float], optional
+        Weights of the parts, by default all equal
+    keyword_fields : Tuple[str], optional
+        Scene description fields the keywords come from, by default
+        Characters and Place
+    """
+    parts = ('length', 'repetition', 'truncation', 'keywords')
+
+    def __init__(self, target_words=None, min_words=300, n=4, weights=None,
+                 keyword_fields=('Characters', 'Place')):
+        self.target_words = target_words
+        self.min_words = min_words
+        self.n = n
+        self.weights = {part: 1.0 for part in self.parts}
+        self.weights.update(weights or {})
+        self.keyword_fields = keyword_fields
+        fields = '|'.join(re.escape(field) for field in keyword_fields)
+        self._field_re = re.compile(rf'^\W*(?:{fields})\W*:(.+)$',
+                                    re.MULTILINE | re.IGNORECASE)
+
+    def keywords(self, scene):
+        """Lowercase words of the description's keyword fields"""
+        keywords = set()
+        for value in self._field_re.findall(scene or ''):
+            for item in _split_re.split(value):
+                keywords.update(word.lower() for word in _word_re.findall(item)
+                                if len(word) > 3
+                                and word.lower() not in _stopwords)
+        return keywords
+
+    def length_score(self, n_words):
+        if self.target_words:
+            ratio = n_words / self.target_words
+            return ratio if ratio <= 1 else max(1 - (ratio - 1) / 2, 0)
+        return min(n_words / self.min_words, 1)
+
+    def repetition_score(self, words):
+        ngrams = [tuple(words[i:i + self.n])
+                  for i in range(len(words) - self.n + 1)]
+        if not ngrams:
+            return 1.0
+        repeated = sum(count - 1 for count in Counter(ngrams).values())
+        return 1 - repeated / len(ngrams)
+
+    def score(self, raw_text, scene_text, scene=None):
+        """Rates a candidate
+
+        Parameters
+        ----------
+        raw_text : str
+            Completion as streamed
+        scene_text : str
+            The same after prepare_scene_text
+        scene : str, optional
+            Scene description the candidate was written from
+
+        Returns
+        -------
+        float
+            Weighted score
+        Dict[str, float]
+            Score of every part
+        """
+        words = [word.lower() for word in _word_re.findall(scene_text or '')]
+        if not words:
+            return 0.0, dict.fromkeys(self.parts, 0.0)
+        raw_len = len(raw_text.strip())
+        keywords = self.keywords(scene)
+        scores = {
+            'length': self.length_score(len(words)),
+            'repetition': self.repetition_score(words),
+            'truncation': (min(len(scene_text.strip()) / raw_len, 1)
+                           if raw_len else 0.0),
+            'keywords': (len(keywords & set(words)) / len(keywords)
+                         if keywords else 1.0),
+        }
+        total = sum(self.weights.values())
+        score = sum(self.weights[part] * value
+                    for part, value in scores.items()) / total
+        return score, scores
@@ -0,0 +1,251 @@
+"""Output sinks receiving scenes and streamed tokens as they are generated."""
+import os
+import sys
+import json
+import time
+import threading
+
+
+class SceneSink:
+    """Base sink, receives scene records from StoryAgent.iter_story
+
+    Scene records are dicts with ``act``, ``chapter``, ``scene``,
+    ``index`` and ``text``. Sinks that set ``wants_deltas`` also receive
+    token delta records with ``chapter``, ``scene`` and ``text``.
+    """
+    wants_deltas = False
+
+    def write_scene(self, record):
+        raise NotImplementedError
+
+    def write_delta(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSceneSink(SceneSink):
+    """Appends scenes to a text file in the example_usage.py layout"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'w', encoding='utf-8')
+
+    def write_scene(self, record):
+        self._fp.write(f"\n\n{'='*50}\n")
+        self._fp.write(f"SCENE {record['index']+1}\n")
+        self._fp.write(f"{'='*50}\n\n")
+        self._fp.write(record['text'])
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class JSONLSceneSink(SceneSink):
+    """Writes one JSON line per scene, fsynced so readers can tail it
+
+    Parameters
+    ----------
+    path : str
+        Output file
+    deltas : bool, optional
+        Also write token delta records, by default False
+    """
+
+    def __init__(self, path, deltas=False):
+        self.path = path
+        self.wants_deltas = deltas
+        self._fp = open(path, 'w', encoding='utf-8')
+
+    def _write(self, record):
+        self._fp.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._fp.flush()
+
+    def write_scene(self, record):
+        self._write(record)
+        os.fsync(self._fp.fileno())
+
+    def write_delta(self, record):
+        self._write(record)
+
+    def close(self):
+        self._fp.close()
+
+
+class CallbackSceneSink(SceneSink):
+    """Forwards records to user callbacks
+
+    Parameters
+    ----------
+    on_scene : Callable[[dict], None]
+        Called with every scene record
+    on_delta : Callable[[dict], None], optional
+        Called with every token delta record
+    """
+
+    def __init__(self, on_scene, on_delta=None):
+        self.on_scene = on_scene
+        self.on_delta = on_delta
+        self.wants_deltas = on_delta is not None
+
+    def write_scene(self, record):
+        self.on_scene(record)
+
+    def write_delta(self, record):
+        if self.on_delta is not None:
+            self.on_delta(record)
+
+
+class TokenSink:
+    """Base sink for the tokens streamed by every request
+
+    ``open`` is called once per request and returns the object receiving
+    that request's tokens (``write``), progress messages (``status``) and
+    end (``end``). Sinks without per-request state return themselves.
+    ``close`` releases the sink itself.
+    """
+
+    def open(self):
+        return self
+
+    def write(self, content):
+        pass
+
+    def status(self, text):
+        pass
+
+    def end(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SilentTokenSink(TokenSink):
+    """Drops all streamed output"""
+
+
+class _BufferedTokenStream:
+    """Per-request buffer of a _BufferedTokenSink"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.parts = []
+        self.n_chars = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, content):
+        self.parts.append(content)
+        self.n_chars += len(content)
+        if (self.n_chars >= self.sink.flush_chars or
+                time.monotonic() - self.last_flush >= self.sink.flush_interval):
+            self.flush()
+
+    def status(self, text):
+        self.parts.append(f'\n{text}\n')
+        self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.sink._write(''.join(self.parts))
+            self.parts = []
+            self.n_chars = 0
+        self.last_flush = time.monotonic()
+
+    def end(self):
+        self.flush()
+
+
+class _BufferedTokenSink(TokenSink):
+    """Writes every request's tokens in chunks instead of one by one
+
+    A request's buffer is written (and flushed) once it holds
+    ``flush_chars`` characters, ``flush_interval`` seconds after the
+    previous write and when the request ends. Chunks are written whole
+    under a lock, so requests running in parallel do not interleave
+    mid-chunk.
+    """
+
+    def __init__(self, flush_chars=512, flush_interval=0.5):
+        self.flush_chars = flush_chars
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+
+    def _stream(self):
+        raise NotImplementedError
+
+    def _write(self, text):
+        with self._lock:
+            stream = self._stream()
+            stream.write(text)
+            stream.flush()
+
+    def open(self):
+        return _BufferedTokenStream(self)
+
+
+class ConsoleTokenSink(_BufferedTokenSink):
+    """Buffered echo of streamed tokens to stdout
+
+    Parameters
+    ----------
+    flush_chars : int, optional
+        Characters buffered per request before writing, by default 512
+    flush_interval : float, optional
+        Max seconds between writes of a streaming request, by default 0.5
+    """
+
+    def _stream(self):
+        # Looked up on every write so redirected stdout is honoured
+        return sys.stdout
+
+
+class FileTokenSink(_BufferedTokenSink):
+    """Appends streamed tokens to a log file
+
+    Parameters
+    ----------
+    path : str
+        Log file, appended to
+    flush_chars : int, optional
+        Characters buffered per request before writing, by default 4096
+    flush_interval : float, optional
+        Max seconds between writes of a streaming request, by default 5
+    """
+
+    def __init__(self, path, flush_chars=4096, flush_interval=5):
+        super().__init__(flush_chars=flush_chars,
+                         flush_interval=flush_interval)
+        self.path = path
+        self._fp = open(path, 'a', encoding='utf-8')
+
+    def _stream(self):
+        return self._fp
+
+    def close(self):
+        self._fp.close()
+
+
+class CallbackTokenSink(TokenSink):
+    """Forwards tokens and progress messages to callbacks
+
+    Parameters
+    ----------
+    on_token : Callable[[str], None]
+        Called with every streamed token
+    on_status : Callable[[str], None], optional
+        Called with progress messages such as retries
+    """
+
+    def __init__(self, on_token, on_status=None):
+        self.on_token = on_token
+        self.on_status = on_status
+
+    def write(self, content):
+        self.on_token(content)
+
+    def status(self, text):
+        if self.on_status is not None:
+            self.on_status(text)
@@ -1,22 +1,74 @@
-import sys
 import time
-import re
+import random
 import json
-import requests
+import math
+import hashlib
+import queue
+import threading
 import traceback
+import contextlib
+import contextvars
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
-from goat_storytelling_agent import utils
-from goat_storytelling_agent.plan import Plan
+from goat_storytelling_agent import utils, structured
+from goat_storytelling_agent.plan import Plan, PlanStreamParser, SceneStreamParser
+from goat_storytelling_agent.backends import (BackendPool, book_affinity,
+                                               affinity)
+from goat_storytelling_agent.cache import ResponseCache
+from goat_storytelling_agent.journal import BookJournal
+from goat_storytelling_agent.regeneration import (render_act_scenes,
+                                                  chapter_texts, tail_consumers)
+from goat_storytelling_agent.sinks import ConsoleTokenSink, SilentTokenSink
+from goat_storytelling_agent.monitors import SceneHeaderStop, RepetitionMonitor
+from goat_storytelling_agent.scoring import SceneScorer
+from goat_storytelling_agent.metrics import Metrics, timed_stage, current_stage
+from goat_storytelling_agent.tokens import (TokenCounter, ContextBudget,
+                                            GenerationBudgets)
+from goat_storytelling_agent.transport import Transport, get_default_transport
 
 
 SUPPORTED_BACKENDS = ["koboldcpp"]  # Only koboldcpp supported
+SCENE_PROMPT_LAYOUTS = ['default', 'prefix']
+PLAN_CONTEXTS = ['full', 'window']
+TOKEN_SINKS = ['console', 'silent']
+# Affinity keys whose last prompt is kept for the shared prefix stats
+MAX_TRACKED_PROMPTS = 256
 
 
 def _query_chat_koboldcpp(endpoint, messages, retries=3, request_timeout=120,
-                          max_tokens=4096, extra_options={}):
-    """Query KoboldCpp using OpenAI compatible API"""
-    endpoint = endpoint.rstrip('/')
+                          max_tokens=4096, extra_options={}, transport=None,
+                          on_delta=None, monitors=None, backoff_base=2,
+                          backoff_max=60, stats=None, token_sink=None):
+    """Query KoboldCpp using OpenAI compatible API
+
+    ``endpoint`` is either a single uri or a BackendPool, in which case
+    every attempt is routed through the pool and a failed attempt is
+    retried on another backend. ``on_delta`` is called with every streamed
+    piece of content as it arrives. Any of ``monitors`` (StreamMonitor)
+    can end the stream early, the text received so far is returned as
+    cut by the monitors that stopped it.
+
+    When a stream dies halfway the partial output is kept and the next
+    attempt resubmits it as a trailing assistant message, which KoboldCpp
+    continues instead of generating the whole completion again. Requests
+    constrained by a ``grammar`` option start over instead, since the
+    grammar only applies from the start of the generated text. Attempts
+    are spaced by exponential backoff with jitter.
+
+    Streamed tokens and progress messages, including errors and retries,
+    go to ``token_sink``, by default a ConsoleTokenSink. If a ``stats``
+    dict is given it is filled with ``attempts``, ``backend``, ``ttft``
+    (seconds to the first content), ``deltas`` (content deltas of the
+    returned text), ``bytes_streamed`` and ``finish_reason`` (None unless
+    the server sent one).
+    """
+    monitors = monitors or []
+    if isinstance(endpoint, str):
+        endpoint = BackendPool(endpoint)
     headers = {'Content-Type': 'application/json'}
+    if transport is None:
+        transport = get_default_transport()
     
     # Default parameters for Mistral Large
     default_params = {
@@ -34,46 +86,129 @@ def _query_chat_koboldcpp(endpoint, messages, retries=3, request_timeout=120,
         **default_params
     }
     
-    print(f"\n========== Submitting request to KoboldCpp...")
-    sys.stdout.flush()
-    
+    if token_sink is None:
+        token_sink = ConsoleTokenSink()
+    tokens = token_sink.open()
+    tokens.status("========== Submitting request to KoboldCpp...")
+    # Content is collected in a list and joined once, not concatenated
+    parts = []
+    n_deltas = 0  # Streamed deltas are roughly one token each
+    attempt = 0
+    if stats is None:
+        stats = {}
+    stats.update(attempts=0, backend=None, ttft=None, deltas=0,
+                 bytes_streamed=0, finish_reason=None)
+    start = time.perf_counter()
     while retries > 0:
+        response = None
+        ok = False
+        request_data = data
+        if parts and 'grammar' in data:
+            # The discarded tokens are not part of the completion
+            parts = []
+            n_deltas = 0
+            stats.update(deltas=0, finish_reason=None)
+        if parts:
+            if n_deltas >= max_tokens:
+                tokens.end()
+                return ''.join(parts).strip()
+            # Monitors and on_delta consumers have already seen the partial
+            # text, only the continuation is streamed to them
+            tokens.status(f"========== Resuming after {n_deltas} "
+                          f"streamed tokens...")
+            request_data = {
+                **data,
+                "messages": messages + [{"role": "assistant",
+                                         "content": ''.join(parts)}],
+                "max_tokens": max_tokens - n_deltas,
+            }
+        else:
+            for monitor in monitors:
+                monitor.reset()
+        backend = endpoint.acquire()
+        stats['attempts'] += 1
+        stats['backend'] = backend.uri
         try:
-            response = requests.post(
-                f"{endpoint}/chat/completions",
+            response = transport.post(
+                f"{backend.uri}/chat/completions",
                 headers=headers,
-                data=json.dumps(data),
+                data=json.dumps(request_data),
                 timeout=request_timeout,
                 stream=True
             )
+            response.raise_for_status()
             
-            result = ""
+            done = False
+            stopped = []
+            # The body is drained to the end even after [DONE] so that the
+            # connection goes back to the keep-alive pool
             for line in response.iter_lines():
-                if line:
+                stats['bytes_streamed'] += len(line) + 1
+                if line and not done:
                     line = line.decode('utf-8')
                     if line.startswith("data: "):
                         if line.strip() == "data: [DONE]":
-                            break
+                            done = True
+                            continue
                         try:
                             json_data = json.loads(line[6:])
                             if 'choices' in json_data and len(json_data['choices']) > 0:
-                                delta = json_data['choices'][0].get('delta', {})
+                                choice = json_data['choices'][0]
+                                if choice.get('finish_reason'):
+                                    stats['finish_reason'] = choice['finish_reason']
+                                delta = choice.get('delta', {})
                                 content = delta.get('content', '')
-                                result += content
-                                print(content, end='')
-                                sys.stdout.flush()
+                                # Role and finish chunks carry no token
+                                if not content:
+                                    continue
+                                n_deltas += 1
+                                stats['deltas'] += 1
+                                parts.append(content)
+                                if stats['ttft'] is None:
+                                    stats['ttft'] = time.perf_counter() - start
+                                tokens.write(content)
+                                if on_delta is not None:
+                                    on_delta(content)
+                                stopped = [monitor for monitor in monitors
+                                           if monitor.feed(content)]
+                                if stopped:
+                                    break
                         except json.JSONDecodeError:
                             continue
             
-            print("\nDone reading response.")
-            return result.strip()
+            if stopped:
+                # Closing the stream makes the server stop generating
+                response.close()
+                tokens.status("Stopped reading response early.")
+            else:
+                tokens.status("Done reading response.")
+            tokens.end()
+            ok = True
+            text = ''.join(parts)
+            for monitor in stopped:
+                text = monitor.cut(text)
+            return text.strip()
             
         except Exception as e:
-            traceback.print_exc()
-            print(f'Error: {e}, retrying...')
+            if response is not None:
+                # Drops a possibly broken connection instead of pooling it
+                response.close()
+            tokens.status(traceback.format_exc().rstrip())
             retries -= 1
-            time.sleep(5)
+            attempt += 1
+            if retries > 0:
+                # Exponential backoff, jittered so that agents sharing a
+                # recovering server do not retry in lockstep
+                delay = min(backoff_max, backoff_base * 2 ** (attempt - 1))
+                delay = delay / 2 + random.uniform(0, delay / 2)
+                tokens.status(f'Error: {e}, retrying in {delay:.1f}s...')
+                time.sleep(delay)
+            else:
+                tokens.status(f'Error: {e}, giving up.')
+        finally:
+            endpoint.release(backend, ok=ok)
     
+    tokens.end()
     return ''
 
 
@@ -81,7 +216,21 @@ class StoryAgent:
     def __init__(self, backend_uri='http://localhost:5001/v1', backend="koboldcpp", 
                  request_timeout=120, max_tokens=4096, n_crop_previous=400,
                  prompt_engine=None, form='novel',
-                 extra_options={}, scene_extra_options={}):
+                 extra_options={}, scene_extra_options={},
+                 pool_size=4, transport=None,
+                 backend_weights=None, routing='least_outstanding',
+                 cache=None, stop_scene_headers=True,
+                 scene_stop_sequences=None, scene_prompt_layout='default',
+                 plan_context='full', plan_window=1, plan_budget=None,
+                 context_size=None, context_margin=64, prompt_budgets=None,
+                 min_crop_previous=50, crop_across_scenes=False,
+                 backoff_base=2, backoff_max=60, structured_output=False,
+                 spec_field_retries=3, stop_repetition=True,
+                 repetition_retries=1, repetition_retry_options=None,
+                 metrics=None, token_sink='console', generation_budgets=None,
+                 scene_target_words=None, max_scene_continuations=4,
+                 scene_candidates=1, candidate_wave=None,
+                 candidate_threshold=0.85, scene_scorer=None):
 
         self.backend = backend.lower()
         if self.backend not in SUPPORTED_BACKENDS:
@@ -115,15 +264,280 @@ class StoryAgent:
         self.backend_uri = backend_uri
         self.n_crop_previous = n_crop_previous
         self.request_timeout = request_timeout
+        # Every stage goes through the same pooled keep-alive sessions
+        if transport is None:
+            transport = Transport(pool_size=pool_size)
+        self.transport = transport
+        # backend_uri may list several KoboldCpp instances or be a
+        # preconfigured BackendPool
+        if isinstance(backend_uri, BackendPool):
+            self.backends = backend_uri
+        else:
+            self.backends = BackendPool(backend_uri, weights=backend_weights,
+                                        strategy=routing, transport=transport)
+        # Optional admission control shared between agents/books, any object
+        # with a slot() context manager (see scheduler.RequestGate)
+        self.request_gate = None
+        # Optional on-disk completion cache, a ResponseCache or a directory
+        if isinstance(cache, str):
+            cache = ResponseCache(cache)
+        self.cache = cache
+        # Scenes stop streaming once the model starts the next scene, that
+        # part would be cut by prepare_scene_text anyway. Server-side stop
+        # sequences are opt-in since the model often opens a scene with
+        # 'Chapter N' / 'Scene N' header lines that must not stop it.
+        self.stop_scene_headers = stop_scene_headers
+        self.scene_stop_sequences = scene_stop_sequences
+        # 'prefix' orders scene prompts from the most to the least stable
+        # part so the backend can reuse the processed prompt between scenes
+        if scene_prompt_layout not in SCENE_PROMPT_LAYOUTS:
+            raise ValueError(
+                f"Scene prompt layout must be one of {SCENE_PROMPT_LAYOUTS}, "
+                f"got '{scene_prompt_layout}'")
+        self.scene_prompt_layout = scene_prompt_layout
+        # 'window' keeps only the chapters around the current one in full
+        # and summarises the other acts, see Plan.window_2_str
+        if plan_context not in PLAN_CONTEXTS:
+            raise ValueError(
+                f"Plan context must be one of {PLAN_CONTEXTS}, "
+                f"got '{plan_context}'")
+        self.plan_context = plan_context
+        self.plan_window = plan_window
+        self.plan_budget = plan_budget
+        self._act_summaries = {}
+        # With context_size set, prompts are measured with the backend
+        # tokenizer: scene prompts are trimmed to fit and max_tokens is
+        # lowered so prompt and generation never overflow the context
+        self.token_counter = TokenCounter(self.backends, transport=transport)
+        self.context_budget = None
+        if context_size is not None:
+            self.context_budget = ContextBudget(
+                context_size, margin=context_margin,
+                prompt_budgets=prompt_budgets)
+        self.min_crop_previous = min_crop_previous
+        # The previous-scene context may reach back over several short
+        # scenes instead of only the last one
+        self.crop_across_scenes = crop_across_scenes
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Shared prompt prefix between consecutive requests of a book
+        self.prefix_stats = {'requests': 0, 'prompt_chars': 0,
+                             'shared_prefix_chars': 0,
+                             'last_shared_prefix_chars': 0}
+        self._last_prompts = collections.OrderedDict()
+        self._stats_lock = threading.Lock()
+        # Spec, plan and scene breakdown come back as grammar constrained
+        # JSON instead of free text that the model may format wrongly
+        self.structured_output = structured_output
+        # Requests repeated per stage because the answer could not be used
+        self.stage_retries = collections.Counter()
+        self.spec_field_retries = spec_field_retries
+        # Scenes stuck in a loop are stopped instead of filling max_tokens
+        # and re-issued with sampling that discourages repetition
+        self.stop_repetition = stop_repetition
+        self.repetition_retries = repetition_retries
+        if repetition_retry_options is None:
+            repetition_retry_options = {
+                'temperature': round(
+                    self.scene_extra_options['temperature'] - 0.1, 2),
+                'repetition_penalty': round(
+                    self.scene_extra_options['repetition_penalty'] + 0.1, 2),
+            }
+        self.repetition_retry_options = repetition_retry_options
+        # Request and stage metrics, may be shared between agents
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Where streamed tokens are echoed: 'console' (buffered stdout),
+        # 'silent' or any TokenSink, e.g. FileTokenSink/CallbackTokenSink
+        if isinstance(token_sink, str):
+            if token_sink not in TOKEN_SINKS:
+                raise ValueError(f"Token sink must be one of {TOKEN_SINKS} "
+                                 f"or a TokenSink, got '{token_sink}'")
+            token_sink = (ConsoleTokenSink() if token_sink == 'console'
+                          else SilentTokenSink())
+        self.token_sink = token_sink
+        # Optional per-stage max_tokens learned from observed answer
+        # lengths, a GenerationBudgets or the path of its history file
+        if isinstance(generation_budgets, str):
+            generation_budgets = GenerationBudgets(history=generation_budgets,
+                                                   max_tokens=max_tokens)
+        self.generation_budgets = generation_budgets
+        # Scenes shorter than scene_target_words are extended with up to
+        # max_scene_continuations continue_a_scene requests
+        self.scene_target_words = scene_target_words
+        self.max_scene_continuations = max_scene_continuations
+        # Best-of-N scenes: up to scene_candidates completions of the same
+        # prompt, candidate_wave at a time, until one scores at least
+        # candidate_threshold with the local scene_scorer
+        self.scene_candidates = scene_candidates
+        self.candidate_wave = candidate_wave
+        self.candidate_threshold = candidate_threshold
+        if scene_scorer is None:
+            scene_scorer = SceneScorer(target_words=scene_target_words)
+        self.scene_scorer = scene_scorer
+
+    def close(self):
+        """Closes pooled backend connections"""
+        self.transport.close()
 
-    def query_chat(self, messages, retries=3, use_scene_options=False):
-        options = self.scene_extra_options if use_scene_options else self.extra_options
+    def query_chat(self, messages, retries=3, use_scene_options=False,
+                   use_cache=True, on_delta=None, monitors=None, stop=None,
+                   grammar=None, options=None):
+        if options:
+            # Per-request sampler overrides, e.g. for a re-issued request
+            options = {**(self.scene_extra_options if use_scene_options
+                          else self.extra_options), **options}
+        else:
+            options = self.scene_extra_options if use_scene_options else self.extra_options
+        if stop:
+            # Server-side stop sequences, part of the options and cache key
+            options = {**options, 'stop': stop}
+        if grammar:
+            # GBNF grammar KoboldCpp constrains the sampling with
+            options = {**options, 'grammar': grammar}
         
-        result = _query_chat_koboldcpp(
-            self.backend_uri, messages, retries=retries,
-            request_timeout=self.request_timeout,
-            max_tokens=self.max_tokens, extra_options=options)
+        record = {'prompt_chars': sum(len(message['content'])
+                                      for message in messages)}
+        # The effective max_tokens is part of the cache key: answers cut
+        # at different lengths are not interchangeable
+        stage = current_stage.get()
+        budget = max_tokens = self.stage_max_tokens(stage)
+        if self.context_budget is not None:
+            prompt_tokens = self.token_counter.count_messages(messages)
+            record['prompt_tokens'] = prompt_tokens
+            max_tokens = self.context_budget.fit_max_tokens(prompt_tokens,
+                                                            max_tokens)
+        cache_key = None
+        if use_cache and self.cache is not None and self.cache.accepts(options):
+            cache_key = self.cache.make_key(messages, max_tokens, options)
+            result = self.cache.get(cache_key)
+            if result is not None:
+                if on_delta is not None:
+                    on_delta(result)
+                self.metrics.record_request({**record, 'cache_hit': True,
+                                             'ok': True, 'attempts': 0,
+                                             'latency': 0, 'ttft': None})
+                return result
+
+        self._track_prefix(messages)
+        if self.context_budget is not None:
+            # Only scene prompts are trimmed to their stage budget, other
+            # stages are checked here
+            prompt_budget = self.context_budget.prompt_budgets.get(stage)
+            if (prompt_budget is not None
+                    and record['prompt_tokens'] > prompt_budget):
+                self._status(f"Warning: {stage} prompt of "
+                             f"{record['prompt_tokens']} tokens exceeds its "
+                             f"budget of {prompt_budget}")
+        if max_tokens < budget:
+            self._status(f"Warning: {record['prompt_tokens']} prompt tokens "
+                         f"leave room for {max_tokens} of {budget} new tokens")
+        if self.request_gate is None:
+            gate = contextlib.nullcontext()
+        else:
+            gate = self.request_gate.slot()
+        stats = {}
+        queued_at = time.perf_counter()
+        with gate:
+            start = time.perf_counter()
+            result = _query_chat_koboldcpp(
+                self.backends, messages, retries=retries,
+                request_timeout=self.request_timeout,
+                max_tokens=max_tokens, extra_options=options,
+                transport=self.transport, on_delta=on_delta,
+                monitors=monitors, backoff_base=self.backoff_base,
+                backoff_max=self.backoff_max, stats=stats,
+                token_sink=self.token_sink)
+        self.metrics.record_request({
+            **record, 'cache_hit': False, 'ok': bool(result),
+            'backend': stats['backend'], 'attempts': stats['attempts'],
+            'queued': start - queued_at,
+            'latency': time.perf_counter() - start, 'ttft': stats['ttft'],
+            'completion_tokens': stats['deltas'],
+            'max_tokens': max_tokens,
+            'bytes_streamed': stats['bytes_streamed']})
         
+        # Failed requests come back empty and are not worth caching,
+        # neither is output a monitor stopped as degenerate
+        degenerate = bool(monitors) and any(monitor.degenerate
+                                            for monitor in monitors)
+        if degenerate:
+            cache_key = None
+        if self.generation_budgets is not None and result and not degenerate:
+            truncated = (stats['finish_reason'] == 'length'
+                         or stats['deltas'] >= max_tokens)
+            self.generation_budgets.observe(stage, stats['deltas'],
+                                            truncated=truncated)
+        if cache_key is not None and result:
+            self.cache.set(cache_key, result)
+        return result
+
+    def stage_max_tokens(self, stage=None):
+        """max_tokens of the next request of a stage, see generation_budgets"""
+        if self.generation_budgets is None:
+            return self.max_tokens
+        return self.generation_budgets.budget(stage, self.max_tokens)
+
+    def _status(self, text):
+        """Progress message outside a request, sent to the token sink"""
+        tokens = self.token_sink.open()
+        tokens.status(text)
+        tokens.end()
+
+    def _count_retry(self, stage):
+        with self._stats_lock:
+            self.stage_retries[stage] += 1
+        self.metrics.record_retry()
+
+    def _query_json(self, messages, json_example, grammar, use_cache=True):
+        """query_chat asking for grammar constrained JSON"""
+        messages = self.prompt_engine.structured_messages(messages,
+                                                          json_example)
+        return self.query_chat(messages, use_cache=use_cache, grammar=grammar)
+
+    def _track_prefix(self, messages):
+        """Counts the prompt prefix shared with the book's previous request"""
+        prompt = ''.join(f"{message['role']}\n{message['content']}\n"
+                         for message in messages)
+        key = book_affinity.get()
+        with self._stats_lock:
+            previous = self._last_prompts.pop(key, '')
+            self._last_prompts[key] = prompt
+            while len(self._last_prompts) > MAX_TRACKED_PROMPTS:
+                self._last_prompts.popitem(last=False)
+        shared = utils.common_prefix_len(previous, prompt)
+        with self._stats_lock:
+            stats = self.prefix_stats
+            stats['requests'] += 1
+            stats['prompt_chars'] += len(prompt)
+            stats['shared_prefix_chars'] += shared
+            stats['last_shared_prefix_chars'] = shared
+
+    def query_scene(self, messages, on_delta=None, use_cache=True):
+        """query_chat with the scene sampler options and stop settings
+
+        A scene that starts looping is stopped and, up to
+        ``repetition_retries`` times, requested again with
+        ``repetition_retry_options`` merged into the sampler options.
+        """
+        options = None
+        for n_tries in range(self.repetition_retries + 1):
+            monitors = [SceneHeaderStop()] if self.stop_scene_headers else []
+            repetition = None
+            if self.stop_repetition:
+                repetition = RepetitionMonitor()
+                monitors.append(repetition)
+            result = self.query_chat(messages, use_scene_options=True,
+                                     use_cache=use_cache, on_delta=on_delta,
+                                     monitors=monitors,
+                                     stop=self.scene_stop_sequences,
+                                     options=options)
+            if repetition is None or not repetition.degenerate:
+                break
+            self._status(f"Warning: scene started repeating itself after "
+                         f"{repetition.n_words} words")
+            if n_tries < self.repetition_retries:
+                self._count_retry('scene')
+                options = self.repetition_retry_options
         return result
 
     def parse_book_spec(self, text_spec):
@@ -157,6 +571,7 @@ class StoryAgent:
         spec_dict.pop('other', None)
         return spec_dict
 
+    @timed_stage('init_book_spec')
     def init_book_spec(self, topic):
         """Creates initial book specification
 
@@ -173,24 +588,70 @@ class StoryAgent:
             Book specification text
         """
         messages = self.prompt_engine.init_book_spec_messages(topic, self.form)
-        text_spec = self.query_chat(messages)
-        spec_dict = self.parse_book_spec(text_spec)
+        spec_dict = self._query_spec(messages)
 
         text_spec = "\n".join(f"{key}: {value}"
                               for key, value in spec_dict.items())
-        # Check and fill in missing fields
-        for field in self.prompt_engine.book_spec_fields:
-            while not spec_dict[field]:
-                messages = self.prompt_engine.missing_book_spec_messages(
-                    field, text_spec)
-                missing_part = self.query_chat(messages)
-                key, sep, value = missing_part.partition(':')
-                if key.lower().strip() == field.lower().strip():
-                    spec_dict[field] = value.strip()
+        # Check and fill in missing fields, all at once first
+        missing = [field for field in self.prompt_engine.book_spec_fields
+                   if not spec_dict[field]]
+        if missing:
+            self._count_retry('book_spec')
+            messages = self.prompt_engine.missing_book_spec_fields_messages(
+                missing, text_spec)
+            if self.structured_output:
+                filled = structured.parse_spec(
+                    self._query_json(messages,
+                                     structured.spec_example(missing),
+                                     structured.spec_grammar(missing)),
+                    missing) or {}
+            else:
+                filled = self.parse_book_spec(self.query_chat(messages))
+            for field in missing:
+                if filled.get(field):
+                    spec_dict[field] = filled[field]
+        # Then one request per field still missing, concurrently
+        missing = [field for field in missing if not spec_dict[field]]
+        if missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                futures = {
+                    field: executor.submit(
+                        contextvars.copy_context().run,
+                        self._fill_spec_field, field, text_spec)
+                    for field in missing}
+            for field, future in futures.items():
+                spec_dict[field] = future.result()
         text_spec = "\n".join(f"{key}: {value}"
                               for key, value in spec_dict.items())
         return messages, text_spec
 
+    def _fill_spec_field(self, field, text_spec):
+        """Asks for a single missing spec field, '' if every try fails"""
+        messages = self.prompt_engine.missing_book_spec_messages(
+            field, text_spec)
+        for n_tries in range(self.spec_field_retries):
+            self._count_retry('book_spec')
+            missing_part = self.query_chat(messages, use_cache=n_tries == 0)
+            value = self.parse_book_spec(missing_part).get(field)
+            if value:
+                return value
+        print(f'Warning: could not fill in book spec field {field}')
+        return ''
+
+    def _query_spec(self, messages):
+        """Queries a book specification and parses it into a dict"""
+        fields = self.prompt_engine.book_spec_fields
+        if not self.structured_output:
+            return self.parse_book_spec(self.query_chat(messages))
+        text_spec = self._query_json(messages, structured.spec_example(fields),
+                                     structured.spec_grammar(fields))
+        spec_dict = structured.parse_spec(text_spec, fields)
+        if spec_dict is None:
+            # Empty fields are filled in one by one by the caller
+            spec_dict = {field: '' for field in fields}
+        return spec_dict
+
+    @timed_stage('enhance_book_spec')
     def enhance_book_spec(self, book_spec):
         """Make book specification more detailed
 
@@ -208,9 +669,8 @@ class StoryAgent:
         """
         messages = self.prompt_engine.enhance_book_spec_messages(
             book_spec, self.form)
-        text_spec = self.query_chat(messages)
         spec_dict_old = self.parse_book_spec(book_spec)
-        spec_dict_new = self.parse_book_spec(text_spec)
+        spec_dict_new = self._query_spec(messages)
 
         # Check and fill in missing fields
         for field in self.prompt_engine.book_spec_fields:
@@ -221,38 +681,78 @@ class StoryAgent:
                               for key, value in spec_dict_new.items())
         return messages, text_spec
 
-    def create_plot_chapters(self, book_spec):
+    @timed_stage('create_plot_chapters')
+    def create_plot_chapters(self, book_spec, on_event=None, max_tries=3):
         """Create initial by-plot outline of form
 
         Parameters
         ----------
         book_spec : str
             Book specification
+        on_event : Callable[[tuple], None], optional
+            Called with every PlanStreamParser event while the plan streams
+        max_tries : int, optional
+            Requests made before giving up, by default 3
 
         Returns
         -------
         List[Dict]
             Used messages for logging
-        dict
-            Dict with book plan
+        Plan
+            Book plan
+
+        Raises
+        ------
+        RuntimeError
+            If no answer could be parsed into a plan
         """
         messages = self.prompt_engine.create_plot_chapters_messages(book_spec, self.form)
         plan = []
-        while not plan:
-            text_plan = self.query_chat(messages)
+        for n_tries in range(max_tries):
+            if plan:
+                break
+            if n_tries:
+                self._count_retry('plan')
+            # A cached answer that failed to parse would come back again
+            use_cache = n_tries == 0
+            if self.structured_output:
+                plan = structured.parse_plan(self._query_json(
+                    messages, structured.plan_example(),
+                    structured.plan_grammar(), use_cache=use_cache))
+                if plan and on_event is not None:
+                    parser = PlanStreamParser()
+                    text_plan = Plan.plan_2_str(plan)
+                    for event in parser.feed(text_plan) + parser.close():
+                        on_event(event)
+                continue
+            if on_event is None:
+                text_plan = self.query_chat(messages, use_cache=use_cache)
+            else:
+                text_plan = self._query_parsed(
+                    messages, PlanStreamParser(), on_event,
+                    use_cache=use_cache)
             if text_plan:
                 plan = Plan.parse_text_plan(text_plan)
-        return messages, plan
+        if not plan:
+            raise RuntimeError(f"No usable plot outline after {max_tries} "
+                               f"tries")
+        return messages, Plan(plan)
 
-    def enhance_plot_chapters(self, book_spec, plan):
+    @timed_stage('enhance_plot_chapters')
+    def enhance_plot_chapters(self, book_spec, plan, max_tries=3):
         """Enhances the outline to make the flow more engaging
 
+        An act without a usable answer after ``max_tries`` requests is
+        kept as it was, with a warning.
+
         Parameters
         ----------
         book_spec : str
             Book specification
         plan : Dict
             Dict with book plan
+        max_tries : int, optional
+            Requests made per act before keeping it, by default 3
 
         Returns
         -------
@@ -266,19 +766,42 @@ class StoryAgent:
         for act_num in range(3):
             messages = self.prompt_engine.enhance_plot_chapters_messages(
                 act_num, text_plan, book_spec, self.form)
-            act = self.query_chat(messages)
-            if act:
-                act_dict = Plan.parse_act(act)
-                while len(act_dict['chapters']) < 2:
-                    act = self.query_chat(messages)
-                    act_dict = Plan.parse_act(act)
-                else:
-                    plan[act_num] = act_dict
+            act_dict = self._query_act(messages, act_num + 1,
+                                       max_tries=max_tries)
+            if act_dict is not None:
+                plan[act_num] = act_dict
                 text_plan = Plan.plan_2_str(plan)
             all_messages.append(messages)
         return all_messages, plan
 
-    def split_chapters_into_scenes(self, plan, book_spec):
+    def _query_act(self, messages, act_num, max_tries=3):
+        """Enhanced act, None to keep the act unchanged
+
+        A free-text answer needs at least two chapters to be used.
+        """
+        for n_tries in range(max_tries):
+            if n_tries:
+                self._count_retry('enhance_act')
+            # A cached answer that failed to parse would come back again
+            use_cache = n_tries == 0
+            if self.structured_output:
+                act_dict = structured.parse_act(
+                    self._query_json(messages, structured.act_example(),
+                                     structured.act_grammar(),
+                                     use_cache=use_cache),
+                    act_num)
+            else:
+                act = self.query_chat(messages, use_cache=use_cache)
+                act_dict = Plan.parse_act(act) if act else None
+                if act_dict is not None and len(act_dict['chapters']) < 2:
+                    act_dict = None
+            if act_dict is not None:
+                return act_dict
+        print(f'Warning: could not enhance act {act_num}, keeping it')
+        return None
+
+    @timed_stage('split_chapters_into_scenes')
+    def split_chapters_into_scenes(self, plan, book_spec, on_chapter=None):
         """Creates a by-scene breakdown of all chapters
 
         Parameters
@@ -287,6 +810,9 @@ class StoryAgent:
             Dict with book plan
         book_spec : str
             Book specification for additional context
+        on_chapter : Callable[[int, int, List[str]], None], optional
+            Called with act number, chapter number and scenes as soon as
+            a chapter's breakdown has streamed in
 
         Returns
         -------
@@ -295,6 +821,64 @@ class StoryAgent:
         dict
             Dict with updated book plan
         """
+        all_messages, act_chapters = self._act_scenes_messages(plan, book_spec)
+        for i, (act, messages) in enumerate(zip(plan, all_messages), start=1):
+            on_event = None
+            if on_chapter is not None:
+                on_event = (lambda event, i=i:
+                            on_chapter(i, event[1], event[2]))
+            act['act_scenes'] = self._query_act_scenes(
+                messages, act_chapters[i], on_event)
+        self._parse_act_scenes(plan, act_chapters)
+        return all_messages, plan
+
+    @timed_stage('split_chapters_into_scenes')
+    def _query_act_scenes(self, messages, ch_nums, on_event=None,
+                          max_tries=3):
+        """Queries one act's scene breakdown in the free-text format
+
+        ``on_event`` receives SceneStreamParser events, while streaming in
+        free-text mode and once the answer is complete in structured mode.
+        """
+        if not self.structured_output:
+            if on_event is None:
+                return self.query_chat(messages)
+            return self._query_parsed(messages, SceneStreamParser(ch_nums),
+                                      on_event)
+        fields = self.prompt_engine.scene_spec_fields
+        act_scenes = None
+        for n_tries in range(max_tries):
+            if n_tries:
+                self._count_retry('scenes')
+            act_scenes = structured.parse_scenes(
+                self._query_json(messages,
+                                 structured.scenes_example(ch_nums, fields),
+                                 structured.scenes_grammar(ch_nums, fields),
+                                 use_cache=n_tries == 0),
+                ch_nums)
+            if act_scenes is not None:
+                break
+        act_scenes = act_scenes or ''
+        if on_event is not None:
+            parser = SceneStreamParser(ch_nums)
+            for event in parser.feed(act_scenes) + parser.close():
+                on_event(event)
+        return act_scenes
+
+    def _query_parsed(self, messages, parser, on_event, use_cache=True):
+        """query_chat feeding the stream to an incremental parser"""
+        def on_delta(content):
+            for event in parser.feed(content):
+                on_event(event)
+
+        result = self.query_chat(messages, use_cache=use_cache,
+                                 on_delta=on_delta)
+        for event in parser.close():
+            on_event(event)
+        return result
+
+    def _act_scenes_messages(self, plan, book_spec):
+        """Builds scene breakdown requests, one per act"""
         all_messages = []
         act_chapters = {}
         for i, act in enumerate(plan, start=1):
@@ -302,13 +886,15 @@ class StoryAgent:
             act_chapters[i] = chs
             messages = self.prompt_engine.split_chapters_into_scenes_messages(
                 i, text_act, self.form, book_spec)
-            act_scenes = self.query_chat(messages)
-            act['act_scenes'] = act_scenes
             all_messages.append(messages)
+        return all_messages, act_chapters
 
+    @staticmethod
+    def _parse_act_scenes(plan, act_chapters):
+        """Splits each act's raw scene breakdown into chapter_scenes"""
         for i, act in enumerate(plan, start=1):
             act_scenes = act['act_scenes']
-            act_scenes = re.split(r'Chapter (\d+)', act_scenes.strip())
+            act_scenes = SceneStreamParser.chapter_re.split(act_scenes.strip())
 
             act['chapter_scenes'] = {}
             chapters = [text.strip() for text in act_scenes[:]
@@ -319,23 +905,24 @@ class StoryAgent:
                 if snippet.isnumeric():
                     ch_num = int(snippet)
                     if ch_num != current_ch:
-                        current_ch = snippet
+                        current_ch = ch_num
                         merged_chapters[ch_num] = ''
                     continue
                 if merged_chapters:
-                    merged_chapters[ch_num] += snippet
+                    # Drop the colon of the 'Chapter N:' header
+                    merged_chapters[ch_num] += snippet.lstrip(':')
             ch_nums = list(merged_chapters.keys()) if len(
                 merged_chapters) <= len(act_chapters[i]) else act_chapters[i]
             merged_chapters = {ch_num: merged_chapters[ch_num]
                                for ch_num in ch_nums}
             for ch_num, chapter in merged_chapters.items():
-                scenes = re.split(r'Scene \d+.{0,10}?:', chapter)
+                scenes = SceneStreamParser.scene_re.split(chapter)
                 scenes = [text.strip() for text in scenes[1:]
                           if (text and (len(text.split()) > 3))]
                 if not scenes:
                     continue
                 act['chapter_scenes'][ch_num] = scenes
-        return all_messages, plan
+        return plan
 
     @staticmethod
     def prepare_scene_text(text):
@@ -360,7 +947,101 @@ class StoryAgent:
         text = '\n'.join(lines)
         return text
 
-    def write_a_scene(self, scene, sc_num, ch_num, plan, previous_scene=None):
+    @timed_stage('summarize_acts')
+    def summarize_acts(self, plan):
+        """Returns act summaries by act index, each generated only once
+
+        Parameters
+        ----------
+        plan : Dict
+            Dict with book plan
+
+        Returns
+        -------
+        Dict[int, str]
+            Summary of every act
+        """
+        summaries = {}
+        for i in range(len(plan)):
+            text_act = Plan.act_outline(plan, i)
+            key = hashlib.sha1(text_act.encode('utf-8')).hexdigest()
+            summary = self._act_summaries.get(key)
+            if summary is None:
+                messages = self.prompt_engine.summarize_act_messages(
+                    text_act, self.form)
+                summary = self.query_chat(messages)
+                if summary:
+                    self._act_summaries[key] = summary
+            summaries[i] = summary
+        return summaries
+
+    def plan_context_str(self, plan, ch_num):
+        """Plan text used as context for a scene of the chapter"""
+        if self.plan_context == 'window':
+            return Plan.window_2_str(
+                plan, ch_num, window=self.plan_window,
+                summaries=self.summarize_acts(plan), budget=self.plan_budget)
+        return Plan.plan_2_str(plan)
+
+    def _scene_messages(self, scene, sc_num, ch_num, plan, snippet, intro,
+                        book_spec=None):
+        """Builds a scene request, appending the cropped snippet if any"""
+        text_plan = self.plan_context_str(plan, ch_num)
+        if snippet:
+            snippet = utils.keep_last_n_words(snippet, n=self.n_crop_previous)
+        chapter_scenes = None
+        for act in plan:
+            chapter_scenes = act.get('chapter_scenes', {}).get(
+                ch_num, chapter_scenes)
+
+        def build(text_plan, snippet):
+            if self.scene_prompt_layout == 'prefix':
+                return self.prompt_engine.scene_messages_prefix(
+                    scene, sc_num, ch_num, text_plan, self.form,
+                    book_spec=book_spec, chapter_scenes=chapter_scenes,
+                    snippet_intro=intro, snippet=snippet)
+            messages = self.prompt_engine.scene_messages(
+                scene, sc_num, ch_num, text_plan, self.form)
+            if snippet:
+                messages[1]['content'] += f'{intro}\"\"\"{snippet}\"\"\"'
+            return messages
+
+        messages = build(text_plan, snippet)
+        if self.context_budget is None:
+            return messages
+
+        # Trims the previous scene first, then the plan, until it all fits
+        stage = current_stage.get()
+        budget = self.context_budget.prompt_budget(
+            self.stage_max_tokens(stage), stage=stage)
+        count = self.token_counter.count
+        for _ in range(6):
+            over = self.token_counter.count_messages(messages) - budget
+            if over <= 0:
+                return messages
+            n_words = len(snippet.split()) if snippet else 0
+            if n_words > self.min_crop_previous:
+                cut = math.ceil(over * n_words / max(count(snippet), 1)) + 1
+                snippet = utils.keep_last_n_words(
+                    snippet, n=max(n_words - cut, self.min_crop_previous))
+            else:
+                plan_words = len(text_plan.split())
+                cut = math.ceil(over * plan_words / max(count(text_plan), 1))
+                summaries = (self.summarize_acts(plan)
+                             if self.plan_context == 'window' else None)
+                shorter_plan = Plan.window_2_str(
+                    plan, ch_num, window=self.plan_window,
+                    summaries=summaries, budget=max(plan_words - cut - 1, 0))
+                if len(shorter_plan) >= len(text_plan):
+                    break
+                text_plan = shorter_plan
+            messages = build(text_plan, snippet)
+        # query_chat warns about the prompt that could not be trimmed
+        return messages
+
+    @timed_stage('write_a_scene')
+    def write_a_scene(self, scene, sc_num, ch_num, plan, previous_scene=None,
+                      on_delta=None, book_spec=None):
         """Generates a scene text for a form
 
         Parameters
@@ -375,6 +1056,10 @@ class StoryAgent:
             Dict with book plan
         previous_scene : str, optional
             Previous scene text, by default None
+        on_delta : Callable[[str], None], optional
+            Called with raw token deltas while the scene streams
+        book_spec : str, optional
+            Book specification, used by the 'prefix' scene prompt layout
 
         Returns
         -------
@@ -383,19 +1068,93 @@ class StoryAgent:
         str
             Generated scene text
         """
-        text_plan = Plan.plan_2_str(plan)
-        messages = self.prompt_engine.scene_messages(
-            scene, sc_num, ch_num, text_plan, self.form)
-        if previous_scene:
-            previous_scene = utils.keep_last_n_words(previous_scene,
-                                                     n=self.n_crop_previous)
-            messages[1]['content'] += f'{self.prompt_engine.prev_scene_intro}\"\"\"{previous_scene}\"\"\"'
-        generated_scene = self.query_chat(messages, use_scene_options=True)
+        messages = self._scene_messages(
+            scene, sc_num, ch_num, plan, previous_scene,
+            self.prompt_engine.prev_scene_intro, book_spec=book_spec)
+        if self.scene_candidates > 1:
+            generated_scene = self._best_scene(messages, scene)
+            if on_delta is not None:
+                on_delta(generated_scene)
+        else:
+            generated_scene = self.query_scene(messages, on_delta=on_delta)
         generated_scene = self.prepare_scene_text(generated_scene)
+        if self.scene_target_words:
+            generated_scene = self._extend_scene(
+                scene, sc_num, ch_num, plan, generated_scene,
+                on_delta=on_delta, book_spec=book_spec)
         return messages, generated_scene
 
+    def _candidate_waves(self):
+        """Sizes of the candidate waves of a best-of-N scene"""
+        wave = self.candidate_wave or self.scene_candidates
+        waves = []
+        n_left = self.scene_candidates
+        while n_left > 0:
+            waves.append(min(wave, n_left))
+            n_left -= waves[-1]
+        return waves
+
+    def _pick_candidate(self, best, candidates, scene):
+        """Best of the (score, raw text) so far and the new raw texts"""
+        for raw in candidates:
+            score, _ = self.scene_scorer.score(
+                raw, self.prepare_scene_text(raw), scene)
+            if best is None or score > best[0]:
+                best = (score, raw)
+        return best
+
+    def _best_scene(self, messages, scene):
+        """Raw text of the best scoring of up to scene_candidates scenes
+
+        The candidates of a wave are requested concurrently with the same
+        prompt, so a backend reusing its processed prompt only evaluates
+        the shared plan context once. No more waves are started once a
+        candidate scores candidate_threshold.
+        """
+        best = None
+        n_done = 0
+        for n_tries, wave in enumerate(self._candidate_waves()):
+            if n_tries:
+                self._count_retry('scene')
+            with ThreadPoolExecutor(max_workers=wave) as executor:
+                # Only the first candidate may come from the cache, the
+                # others would repeat it
+                futures = [executor.submit(
+                    contextvars.copy_context().run, self.query_scene,
+                    messages, use_cache=n_done + i == 0)
+                    for i in range(wave)]
+            n_done += wave
+            best = self._pick_candidate(
+                best, [future.result() for future in futures], scene)
+            if best[0] >= self.candidate_threshold:
+                break
+        self._status(f"Picked scene candidate scoring {best[0]:.2f} "
+                     f"of {n_done} candidates")
+        return best[1]
+
+    def _extend_scene(self, scene, sc_num, ch_num, plan, text, on_delta=None,
+                      book_spec=None):
+        """Continues a scene until it reaches scene_target_words"""
+        for _ in range(self.max_scene_continuations):
+            if not text or len(text.split()) >= self.scene_target_words:
+                break
+            if on_delta is not None:
+                on_delta('\n\n')
+            _, continuation = self.continue_a_scene(
+                scene, sc_num, ch_num, plan, current_scene=text,
+                on_delta=on_delta, book_spec=book_spec)
+            if not continuation:
+                print(f"Warning: scene {sc_num} of chapter {ch_num} stopped "
+                      f"at {len(text.split())} of {self.scene_target_words} "
+                      f"words")
+                break
+            text = f'{text}\n\n{continuation}'
+        return text
+
+    @timed_stage('continue_a_scene')
     def continue_a_scene(self, scene, sc_num, ch_num,
-                         plan, current_scene=None):
+                         plan, current_scene=None, on_delta=None,
+                         book_spec=None):
         """Continues a scene text for a form
 
         Parameters
@@ -410,6 +1169,10 @@ class StoryAgent:
             Dict with book plan
         current_scene : str, optional
             Text of the current scene so far, by default None
+        on_delta : Callable[[str], None], optional
+            Called with raw token deltas while the continuation streams
+        book_spec : str, optional
+            Book specification, used by the 'prefix' scene prompt layout
 
         Returns
         -------
@@ -418,34 +1181,400 @@ class StoryAgent:
         str
             Generated scene continuation text
         """
-        text_plan = Plan.plan_2_str(plan)
-        messages = self.prompt_engine.scene_messages(
-            scene, sc_num, ch_num, text_plan, self.form)
-        if current_scene:
-            current_scene = utils.keep_last_n_words(current_scene,
-                                                    n=self.n_crop_previous)
-            messages[1]['content'] += f'{self.prompt_engine.cur_scene_intro}\"\"\"{current_scene}\"\"\"'
-        generated_scene = self.query_chat(messages, use_scene_options=True)
+        messages = self._scene_messages(
+            scene, sc_num, ch_num, plan, current_scene,
+            self.prompt_engine.cur_scene_intro, book_spec=book_spec)
+        generated_scene = self.query_scene(messages, on_delta=on_delta)
         generated_scene = self.prepare_scene_text(generated_scene)
         return messages, generated_scene
 
-    def generate_story(self, topic):
-        """Example pipeline for a novel creation"""
-        _, book_spec = self.init_book_spec(topic)
-        _, book_spec = self.enhance_book_spec(book_spec)
-        _, plan = self.create_plot_chapters(book_spec)
-        _, plan = self.enhance_plot_chapters(book_spec, plan)
-        _, plan = self.split_chapters_into_scenes(plan, book_spec)  # Added book_spec parameter
+    def generate_story(self, topic, journal=None, sink=None):
+        """Example pipeline for a novel creation
 
-        form_text = []
-        for act in plan:
+        Parameters
+        ----------
+        topic : str
+            Short initial topic
+        journal : str or BookJournal, optional
+            Append-only checkpoint journal; finished stages recorded in it
+            are not generated again, see ``resume``
+        sink : SceneSink, optional
+            Receives every scene as soon as it is written
+
+        Returns
+        -------
+        List[str]
+            Generated scene texts
+        """
+        return [record['text']
+                for record in self.iter_story(topic, journal=journal,
+                                              sink=sink)]
+
+    def iter_story(self, topic, journal=None, sink=None, deltas=False):
+        """Runs the generate_story pipeline, yielding scenes as they finish
+
+        Parameters
+        ----------
+        topic : str
+            Short initial topic
+        journal : str or BookJournal, optional
+            Append-only checkpoint journal, see ``generate_story``
+        sink : SceneSink, optional
+            Receives every scene (and delta) record, closed at the end
+        deltas : bool, optional
+            Also yield raw token deltas of scenes while they stream,
+            by default False
+
+        Yields
+        ------
+        dict
+            Scene records ``{'type': 'scene', 'act', 'chapter', 'scene',
+            'index', 'text'}`` and, with ``deltas``, delta records
+            ``{'type': 'delta', 'chapter', 'scene', 'text'}``
+        """
+        if isinstance(journal, str):
+            journal = BookJournal(journal)
+        # All requests of the book stick to one backend of the pool. The
+        # pipeline steps run in their own context so the affinity does
+        # not leak into the consumer between two yields.
+        ctx = contextvars.copy_context()
+        ctx.run(book_affinity.set, topic)
+        want_deltas = deltas or (sink is not None and sink.wants_deltas)
+        records = self._iter_story(topic, journal, want_deltas)
+        try:
+            while True:
+                try:
+                    record = ctx.run(next, records)
+                except StopIteration:
+                    break
+                if sink is not None:
+                    if record['type'] == 'scene':
+                        sink.write_scene(record)
+                    else:
+                        sink.write_delta(record)
+                if record['type'] == 'scene' or deltas:
+                    yield record
+        finally:
+            records.close()
+            if sink is not None:
+                sink.close()
+
+    def resume(self, path, sink=None):
+        """Continues an interrupted generate_story from its journal
+
+        Parameters
+        ----------
+        path : str
+            Journal written by ``generate_story(topic, journal=path)``
+        sink : SceneSink, optional
+            Receives every scene, including the already journaled ones
+
+        Returns
+        -------
+        List[str]
+            Generated scene texts
+        """
+        journal = BookJournal(path)
+        topic = journal.load()['topic']
+        if topic is None:
+            raise ValueError(f"Journal {path} does not contain a topic")
+        return self.generate_story(topic, journal=journal, sink=sink)
+
+    def journal_plan(self, journal):
+        """Plan of a journaled book with its scene breakdown, if any
+
+        Save it with ``Plan.save_plan``, edit it and pass it to
+        ``regenerate``.
+        """
+        if isinstance(journal, str):
+            journal = BookJournal(journal)
+        state = journal.load()
+        if state['plan'] is None:
+            raise ValueError(f"Journal {journal.path} does not contain a plan")
+        plan = Plan(state['plan'])
+        act_chapters = {i: Plan.act_2_str(plan, i)[1]
+                        for i in range(1, len(plan) + 1)}
+        for i, act in enumerate(plan, start=1):
+            act['act_scenes'] = state['act_scenes'].get(i, '')
+        return self._parse_act_scenes(plan, act_chapters)
+
+    def plan_regeneration(self, journal, plan):
+        """Works out what has to be generated again after a plan edit
+
+        Chapters are compared by their book-wide number. A chapter whose
+        text changed gets a new scene breakdown, unless the edited plan
+        carries a changed scene list for it already, and a scene whose
+        description changed is written again. So is every scene that got
+        part of a rewritten scene's text as previous-scene context: the
+        next one, or with ``crop_across_scenes`` all within
+        ``n_crop_previous`` words. Other edits, e.g. of an act
+        description, reach the rewritten scenes through their prompts but
+        do not invalidate anything by themselves.
+
+        Parameters
+        ----------
+        journal : str or BookJournal
+            Journal of the generated book
+        plan : str or Plan or List[Dict]
+            Edited plan, or the path of a ``Plan.save_plan`` file
+
+        Returns
+        -------
+        dict
+            ``acts`` broken down again, their ``chapters`` that get new
+            scenes and the ``scenes`` as (ch_num, sc_num) written again,
+            in book order
+        """
+        return self._regeneration(journal, plan)['report']
+
+    def _regeneration(self, journal, plan):
+        if isinstance(journal, str):
+            journal = BookJournal(journal)
+        if isinstance(plan, str):
+            path = plan
+            plan = Plan.load_plan(path)
+            if plan is None:
+                raise ValueError(f"Could not load plan {path}")
+        state = journal.load()
+        old_plan = self.journal_plan(journal)
+        old_texts = chapter_texts(old_plan)
+        old_scenes = {ch_num: scenes for act in old_plan
+                      for ch_num, scenes in act['chapter_scenes'].items()}
+        plan = Plan(plan)
+
+        acts = []
+        chapters = []
+        new_scenes = {}
+        for i, act in enumerate(plan, start=1):
+            if i not in state['act_scenes']:
+                # Not broken down yet, generate_story does the whole act
+                continue
+            edited = act.get('chapter_scenes') or {}
+            for chapter in act.chapters:
+                ch_num = chapter.number
+                scenes = edited.get(ch_num)
+                if scenes is not None and list(scenes) != old_scenes.get(ch_num):
+                    new_scenes[ch_num] = list(scenes)
+                elif (chapter.text != old_texts.get(ch_num)
+                        or ch_num not in old_scenes):
+                    chapters.append(ch_num)
+                    if i not in acts:
+                        acts.append(i)
+                else:
+                    new_scenes[ch_num] = old_scenes[ch_num]
+
+        order = []
+        invalid = set()
+        for ch_num in chapter_texts(plan):
+            if ch_num in chapters:
+                # The new breakdown is not known yet, all of it is new
+                n_scenes = max(len(old_scenes.get(ch_num, [])), 1)
+                keys = [(ch_num, sc_num) for sc_num in range(1, n_scenes + 1)]
+                order.extend(keys)
+                invalid.update(keys)
+                continue
+            old = old_scenes.get(ch_num, [])
+            for sc_num, scene in enumerate(new_scenes.get(ch_num, []),
+                                           start=1):
+                order.append((ch_num, sc_num))
+                if sc_num > len(old) or old[sc_num - 1] != scene:
+                    invalid.add((ch_num, sc_num))
+        words = {key: len(text.split())
+                 for key, text in state['scenes'].items()}
+        consumers = tail_consumers(order, invalid, words,
+                                   self.n_crop_previous,
+                                   self.crop_across_scenes)
+        scenes = [key for key in order if key in invalid or key in consumers]
+        dropped = set(scenes) | {key for key in state['scenes']
+                                 if key[0] in chapters}
+        return {'report': {'acts': acts, 'chapters': chapters,
+                           'scenes': scenes},
+                'journal': journal, 'state': state, 'plan': plan,
+                'old_scenes': old_scenes, 'new_scenes': new_scenes,
+                'dropped': sorted(key for key in dropped
+                                  if key in state['scenes'])}
+
+    def regenerate(self, journal, plan, sink=None):
+        """Brings a generated book in line with an edited plan
+
+        Only what ``plan_regeneration`` reports is generated again, the
+        journal is updated so that ``resume`` gives the edited book too.
+
+        Parameters
+        ----------
+        journal : str or BookJournal
+            Journal written by ``generate_story(topic, journal=path)``
+        plan : str or Plan or List[Dict]
+            Edited plan, or the path of a ``Plan.save_plan`` file
+        sink : SceneSink, optional
+            Receives every scene, including the kept ones
+
+        Returns
+        -------
+        List[str]
+            Scene texts of the whole book
+        """
+        regeneration = self._regeneration(journal, plan)
+        journal = regeneration['journal']
+        state = regeneration['state']
+        plan = regeneration['plan']
+        report = regeneration['report']
+        new_scenes = regeneration['new_scenes']
+        topic = state['topic']
+
+        base_plan = [{'act_descr': act['act_descr'],
+                      'chapters': list(act['chapters'])} for act in plan]
+        if base_plan != state['plan']:
+            journal.append('plan', plan=base_plan)
+        with affinity(topic):
+            new_scenes.update(self._regenerate_breakdowns(
+                plan, state['book_spec'], report['acts'],
+                report['chapters'], regeneration['old_scenes']))
+        for i, act in enumerate(plan, start=1):
+            _, chs = Plan.act_2_str(plan, i)
+            merged = {ch_num: new_scenes[ch_num] for ch_num in chs
+                      if new_scenes.get(ch_num)}
+            old = {ch_num: regeneration['old_scenes'][ch_num] for ch_num in chs
+                   if regeneration['old_scenes'].get(ch_num)}
+            if i in state['act_scenes'] and merged != old:
+                journal.append('act_scenes', act=i,
+                               text=render_act_scenes(merged))
+        if regeneration['dropped']:
+            journal.append('invalidate', scenes=regeneration['dropped'])
+        return self.generate_story(topic, journal=journal, sink=sink)
+
+    @timed_stage('split_chapters_into_scenes')
+    def _regenerate_breakdowns(self, plan, book_spec, acts, chapters,
+                               old_scenes):
+        """New scene lists of the given chapters, by breaking down acts"""
+        all_messages, act_chapters = self._act_scenes_messages(plan, book_spec)
+        new_scenes = {}
+        for i in acts:
+            act_scenes = self._query_act_scenes(all_messages[i - 1],
+                                                act_chapters[i])
+            parsed = self._parse_act_scenes([{'act_scenes': act_scenes}],
+                                            {1: act_chapters[i]})
+            for ch_num in act_chapters[i]:
+                if ch_num not in chapters:
+                    continue
+                scenes = parsed[0]['chapter_scenes'].get(ch_num)
+                if not scenes:
+                    print(f"Warning: no new scenes for chapter {ch_num}, "
+                          f"keeping the old ones")
+                    scenes = old_scenes.get(ch_num, [])
+                new_scenes[ch_num] = scenes
+        return new_scenes
+
+    def _stream_scene(self, scene, sc_num, ch_num, plan, previous_scene,
+                      book_spec):
+        """write_a_scene yielding delta records, the last item is the text
+
+        The request runs in a worker thread that feeds the deltas through
+        a queue, so they reach the consumer while the scene streams.
+        """
+        deltas = queue.Queue()
+        outcome = {}
+
+        def on_delta(content):
+            deltas.put({'type': 'delta', 'chapter': ch_num, 'scene': sc_num,
+                        'text': content})
+
+        def work():
+            try:
+                _, outcome['text'] = self.write_a_scene(
+                    scene, sc_num, ch_num, plan,
+                    previous_scene=previous_scene, on_delta=on_delta,
+                    book_spec=book_spec)
+            except BaseException as e:
+                outcome['error'] = e
+            finally:
+                deltas.put(None)
+
+        ctx = contextvars.copy_context()
+        worker = threading.Thread(target=ctx.run, args=(work,), daemon=True)
+        worker.start()
+        while True:
+            record = deltas.get()
+            if record is None:
+                break
+            yield record
+        worker.join()
+        if 'error' in outcome:
+            raise outcome['error']
+        yield outcome['text']
+
+    def _iter_story(self, topic, journal, deltas):
+        if journal is not None:
+            state = journal.load()
+            if state['topic'] is None:
+                journal.append('topic', topic=topic)
+            elif state['topic'] != topic:
+                print(f"Warning: journal {journal.path} was started for "
+                      f"topic '{state['topic']}'")
+        else:
+            state = BookJournal.empty_state()
+
+        book_spec = state['book_spec']
+        if book_spec is None:
+            _, book_spec = self.init_book_spec(topic)
+            _, book_spec = self.enhance_book_spec(book_spec)
+            if journal is not None:
+                journal.append('book_spec', text=book_spec)
+        plan = state['plan']
+        if plan is None:
+            _, plan = self.create_plot_chapters(book_spec)
+            _, plan = self.enhance_plot_chapters(book_spec, plan)
+            if journal is not None:
+                journal.append('plan', plan=plan.to_list())
+        else:
+            plan = Plan(plan)
+
+        all_messages, act_chapters = self._act_scenes_messages(plan, book_spec)
+        for i, (act, messages) in enumerate(zip(plan, all_messages), start=1):
+            act_scenes = state['act_scenes'].get(i)
+            if act_scenes is None:
+                act_scenes = self._query_act_scenes(messages, act_chapters[i])
+                if journal is not None and act_scenes:
+                    journal.append('act_scenes', act=i, text=act_scenes)
+            act['act_scenes'] = act_scenes
+        self._parse_act_scenes(plan, act_chapters)
+
+        # Only the tail needed as context for the next scene is kept around
+        previous_scene = None
+        tail = utils.TailWindow(self.n_crop_previous)
+        index = 0
+        for act_num, act in enumerate(plan, start=1):
             for ch_num, chapter in act['chapter_scenes'].items():
                 sc_num = 1
                 for scene in chapter:
-                    previous_scene = form_text[-1] if form_text else None
-                    _, generated_scene = self.write_a_scene(
-                        scene, sc_num, ch_num, plan,
-                        previous_scene=previous_scene)
-                    form_text.append(generated_scene)
+                    generated_scene = state['scenes'].pop((ch_num, sc_num),
+                                                          None)
+                    if generated_scene is None:
+                        if deltas:
+                            for item in self._stream_scene(
+                                    scene, sc_num, ch_num, plan,
+                                    previous_scene, book_spec):
+                                if isinstance(item, dict):
+                                    yield item
+                                else:
+                                    generated_scene = item
+                        else:
+                            _, generated_scene = self.write_a_scene(
+                                scene, sc_num, ch_num, plan,
+                                previous_scene=previous_scene,
+                                book_spec=book_spec)
+                        # Empty scenes come from exhausted retries and are
+                        # generated again on resume
+                        if journal is not None and generated_scene:
+                            journal.append('scene', ch=ch_num, sc=sc_num,
+                                           text=generated_scene)
+                    yield {'type': 'scene', 'act': act_num,
+                           'chapter': ch_num, 'scene': sc_num,
+                           'index': index, 'text': generated_scene}
+                    if self.crop_across_scenes:
+                        tail.append(generated_scene)
+                        previous_scene = tail.text()
+                    else:
+                        previous_scene = generated_scene
+                    index += 1
                     sc_num += 1
-        return form_text
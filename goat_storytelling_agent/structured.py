@@ -0,0 +1,181 @@
+"""Grammar constrained JSON output for the spec, plan and scene breakdown."""
+import re
+import json
+
+
+# Shared GBNF rules, strings must not be empty and indentation is bounded
+# so a constrained model cannot pad the answer up to max_tokens
+_GBNF_COMMON = r'''
+string ::= "\"" char+ "\""
+char ::= [^"\\\x7F\x00-\x1F] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F])
+ws ::= | " " | "\n" [ \t]{0,20}
+'''
+
+
+def _literal(text):
+    """GBNF literal matching text as a JSON string"""
+    dump = json.dumps(text, ensure_ascii=False)
+    return '"' + dump.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _object(members):
+    """GBNF sequence of a JSON object with fixed (key, rule) members"""
+    body = ' "," ws '.join(f'{_literal(key)} ws ":" ws {rule} ws'
+                           for key, rule in members)
+    return f'"{{" ws {body} "}}"'
+
+
+def _array(rule, min_items=1, max_items=None):
+    """GBNF sequence of a JSON array of min_items..max_items items"""
+    items = ' "," ws '.join([f'{rule} ws'] * min_items)
+    if max_items is None:
+        items += f' ("," ws {rule} ws)*'
+    else:
+        items += f' ("," ws {rule} ws)?' * (max_items - min_items)
+    return f'"[" ws {items} "]"'
+
+
+def spec_grammar(fields):
+    """Book specification: one string per field"""
+    root = _object([(field, 'string') for field in fields])
+    return f'root ::= {root}\n' + _GBNF_COMMON
+
+
+def act_grammar(min_chapters=2):
+    """Single act with its chapters"""
+    act = _object([('act_descr', 'string'),
+                   ('chapters', _array('string', min_chapters))])
+    return f'root ::= act\nact ::= {act}\n' + _GBNF_COMMON
+
+
+def plan_grammar(n_acts=3, min_chapters=1):
+    """By-chapter plan of exactly n_acts acts"""
+    act = _object([('act_descr', 'string'),
+                   ('chapters', _array('string', min_chapters))])
+    root = _object([('acts', _array('act', n_acts, n_acts))])
+    return f'root ::= {root}\nact ::= {act}\n' + _GBNF_COMMON
+
+
+def scenes_grammar(ch_nums, scene_fields):
+    """Scene breakdown of exactly the given chapters, in order"""
+    rules = []
+    chapter_rules = []
+    for ch_num in ch_nums:
+        name = f'chapter{ch_num}'
+        chapter = _object([('chapter', f'"{ch_num}"'),
+                           ('scenes', _array('scene'))])
+        rules.append(f'{name} ::= {chapter}')
+        chapter_rules.append(name)
+    chapters = ' "," ws '.join(f'{rule} ws' for rule in chapter_rules)
+    root = _object([('chapters', f'"[" ws {chapters} "]"')])
+    scene = _object([(field, 'string') for field in scene_fields])
+    return '\n'.join([f'root ::= {root}', *rules,
+                      f'scene ::= {scene}']) + '\n' + _GBNF_COMMON
+
+
+def spec_example(fields):
+    return json.dumps({field: '...' for field in fields}, indent=1)
+
+
+def act_example():
+    return json.dumps({'act_descr': '...', 'chapters': ['...', '...']},
+                      indent=1)
+
+
+def plan_example():
+    act = {'act_descr': '...', 'chapters': ['...', '...']}
+    return json.dumps({'acts': [act, act, act]}, indent=1)
+
+
+def scenes_example(ch_nums, scene_fields):
+    scene = {field: '...' for field in scene_fields}
+    return json.dumps({'chapters': [{'chapter': ch_num, 'scenes': [scene]}
+                                    for ch_num in ch_nums]}, indent=1)
+
+
+def _loads(text):
+    """JSON object in text, None if there is none"""
+    if not text:
+        return None
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else ''
+
+
+def parse_spec(text, fields):
+    """Spec dict as returned by StoryAgent.parse_book_spec, None if invalid"""
+    data = _loads(text)
+    if data is None:
+        return None
+    return {field: _text(data.get(field)) for field in fields}
+
+
+def _act_dict(data, act_num, min_chapters):
+    if not isinstance(data, dict) or not isinstance(data.get('chapters'),
+                                                    list):
+        return None
+    act_descr = _text(data.get('act_descr'))
+    if not re.match(r'Act \d', act_descr):
+        act_descr = f'Act {act_num}: {act_descr}'.strip()
+    chapters = [_text(chapter) for chapter in data['chapters']]
+    chapters = [chapter for chapter in chapters if chapter]
+    if len(chapters) < min_chapters:
+        return None
+    return {'act_descr': act_descr, 'chapters': chapters}
+
+
+def parse_act(text, act_num, min_chapters=2):
+    """Act dict as returned by Plan.parse_act, None if invalid"""
+    return _act_dict(_loads(text), act_num, min_chapters)
+
+
+def parse_plan(text, n_acts=3):
+    """Plan as returned by Plan.parse_text_plan, [] if invalid"""
+    data = _loads(text)
+    if data is None or not isinstance(data.get('acts'), list):
+        return []
+    plan = [_act_dict(act, i, 1)
+            for i, act in enumerate(data['acts'], start=1)]
+    if len(plan) != n_acts or None in plan:
+        return []
+    return plan
+
+
+def parse_scenes(text, ch_nums):
+    """Scene breakdown rendered in the free-text format, None if invalid
+
+    The result is what ``StoryAgent.split_chapters_into_scenes`` stores as
+    ``act_scenes``, so the rest of the pipeline and the journal do not
+    depend on the output mode.
+    """
+    data = _loads(text)
+    if data is None or not isinstance(data.get('chapters'), list):
+        return None
+    lines = []
+    for chapter in data['chapters']:
+        if not isinstance(chapter, dict):
+            return None
+        try:
+            ch_num = int(chapter.get('chapter'))
+        except (TypeError, ValueError):
+            return None
+        if ch_num not in ch_nums or not isinstance(chapter.get('scenes'),
+                                                   list):
+            return None
+        for sc_num, scene in enumerate(chapter['scenes'], start=1):
+            if not isinstance(scene, dict):
+                return None
+            lines.append(f'Chapter {ch_num}:')
+            lines.append(f'Scene {sc_num}:')
+            lines.extend(f'{field}: {_text(value)}'
+                         for field, value in scene.items())
+    return '\n'.join(lines) if lines else None
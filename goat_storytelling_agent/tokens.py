@@ -0,0 +1,298 @@
+"""Token counting and context budgeting against the backend tokenizer."""
+import os
+import json
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from goat_storytelling_agent.backends import BackendPool
+from goat_storytelling_agent.metrics import PIPELINE_STAGES
+from goat_storytelling_agent.transport import get_default_transport
+
+
+class TokenCounter:
+    """Counts tokens with KoboldCpp's tokenizer, cached per text
+
+    Uses the /api/extra/tokencount endpoint of the backend. If it is not
+    reachable a local approximation is used instead and the endpoint is
+    tried again after ``retry_interval`` seconds.
+
+    Parameters
+    ----------
+    backends : BackendPool or str
+        Backend(s) to ask
+    transport : Transport, optional
+        Transport used for the requests
+    cache_size : int, optional
+        Number of texts whose counts are kept, by default 2048
+    chars_per_token : float, optional
+        Ratio used by the local approximation, by default 3.5
+    message_overhead : int, optional
+        Tokens added per chat message for the chat template, by default 8
+    """
+
+    def __init__(self, backends, transport=None, cache_size=2048,
+                 chars_per_token=3.5, message_overhead=8, request_timeout=10,
+                 retry_interval=60):
+        if isinstance(backends, str):
+            backends = BackendPool(backends)
+        self.backends = backends
+        self.transport = transport
+        self.cache_size = cache_size
+        self.chars_per_token = chars_per_token
+        self.message_overhead = message_overhead
+        self.request_timeout = request_timeout
+        self.retry_interval = retry_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._remote_failed_at = None
+
+    def approx(self, text):
+        """Local estimate, errs on the high side for Latin scripts"""
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def _count_remote(self, text):
+        if (self._remote_failed_at is not None and
+                time.monotonic() - self._remote_failed_at < self.retry_interval):
+            return None
+        transport = self.transport or get_default_transport()
+        backend = self.backends.acquire()
+        try:
+            response = transport.post(f'{backend.root}/api/extra/tokencount',
+                                      json={'prompt': text},
+                                      timeout=self.request_timeout)
+            response.raise_for_status()
+            count = int(response.json()['value'])
+        except Exception as e:
+            if self._remote_failed_at is None:
+                print(f'Warning: token count endpoint unavailable ({e}), '
+                      f'using approximation')
+            self._remote_failed_at = time.monotonic()
+            return None
+        finally:
+            # Tokenizer results say nothing about generation health, the
+            # breaker state is left alone either way
+            self.backends.release_slot(backend)
+        self._remote_failed_at = None
+        return count
+
+    def count(self, text):
+        """Number of tokens in text"""
+        if not text:
+            return 0
+        with self._lock:
+            count = self._cache.get(text)
+            if count is not None:
+                self._cache.move_to_end(text)
+                return count
+        count = self._count_remote(text)
+        if count is None:
+            # Approximations are not cached so the real count replaces them
+            return self.approx(text)
+        with self._lock:
+            self._cache[text] = count
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def count_messages(self, messages):
+        """Number of prompt tokens of a chat request"""
+        return sum(self.count(message['content']) + self.message_overhead
+                   for message in messages)
+
+
+class ContextBudget:
+    """Splits the model context between prompt and generation
+
+    Parameters
+    ----------
+    context_size : int
+        Context size the backend was started with
+    margin : int, optional
+        Tokens kept free for the chat template and tokenizer drift,
+        by default 64
+    prompt_budgets : Dict[str, int], optional
+        Max prompt tokens per pipeline stage, e.g. {'write_a_scene': 6000},
+        capped by what the context leaves after generation
+    min_generation : int, optional
+        Generation is never squeezed below this by the prompt, a smaller
+        requested max_tokens is kept as is, by default 256
+    """
+
+    def __init__(self, context_size, margin=64, prompt_budgets=None,
+                 min_generation=256):
+        self.context_size = context_size
+        self.margin = margin
+        prompt_budgets = prompt_budgets or {}
+        unknown = sorted(set(prompt_budgets) - set(PIPELINE_STAGES))
+        if unknown:
+            raise ValueError(f"Prompt budgets must be keyed by stages of "
+                             f"{PIPELINE_STAGES}, got {unknown}")
+        self.prompt_budgets = prompt_budgets
+        self.min_generation = min_generation
+
+    def prompt_budget(self, max_tokens, stage=None):
+        """Max prompt tokens that still leave room for max_tokens"""
+        budget = self.context_size - max_tokens - self.margin
+        if stage in self.prompt_budgets:
+            budget = min(budget, self.prompt_budgets[stage])
+        return budget
+
+    def fit_max_tokens(self, prompt_tokens, max_tokens):
+        """max_tokens reduced so prompt and generation fit the context"""
+        available = self.context_size - prompt_tokens - self.margin
+        return min(max_tokens, max(available, self.min_generation))
+
+
+# Starting max_tokens per stage until enough lengths have been observed
+DEFAULT_STAGE_BUDGETS = {
+    'init_book_spec': 1024,
+    'enhance_book_spec': 1024,
+    'create_plot_chapters': 2048,
+    'enhance_plot_chapters': 1536,
+    'split_chapters_into_scenes': 3072,
+    'summarize_acts': 512,
+}
+
+
+class GenerationBudgets:
+    """Per-stage max_tokens learned from observed completion lengths
+
+    Once a stage has ``min_samples`` observed lengths its budget is their
+    ``quantile`` times ``headroom``, so typical answers fit with room to
+    spare while runaway ones are cut early; before that the default is
+    only ever raised, by the longest observation. Truncated answers only
+    tell that the real length was larger, they are counted as ``growth``
+    times the budget they hit so that an undersized budget grows quickly.
+
+    Observations are appended to the ``history`` JSONL file and the last
+    ``window`` of every stage are loaded from it, so budgets carry over
+    between runs. Loading rewrites the file down to those records once it
+    holds older ones.
+
+    Parameters
+    ----------
+    defaults : Dict[str, int], optional
+        Budgets used until a stage has enough samples, on top of
+        DEFAULT_STAGE_BUDGETS; other stages get max_tokens
+    history : str, optional
+        JSONL file the observed lengths are kept in
+    quantile : float, optional
+        Quantile of the observed lengths, by default 0.95
+    headroom : float, optional
+        Factor applied on top of the quantile, by default 1.25
+    min_samples : int, optional
+        Observations needed before a stage adapts, by default 5
+    window : int, optional
+        Number of recent observations per stage, by default 200
+    min_tokens : int, optional
+        Lower bound of every budget, by default 64
+    max_tokens : int, optional
+        Upper bound of every budget, by default 4096
+    growth : float, optional
+        Factor applied to the length of a truncated answer, by default 2
+    """
+
+    def __init__(self, defaults=None, history=None, quantile=0.95,
+                 headroom=1.25, min_samples=5, window=200, min_tokens=64,
+                 max_tokens=4096, growth=2):
+        self.defaults = {**DEFAULT_STAGE_BUDGETS, **(defaults or {})}
+        self.history = history
+        self.quantile = quantile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.window = window
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.growth = growth
+        self.lengths = defaultdict(lambda: deque(maxlen=window))
+        self.truncations = defaultdict(int)
+        self._lock = threading.Lock()
+        if history is not None and os.path.exists(history):
+            self.load(history)
+
+    def load(self, path):
+        """Adds the observations of a history file
+
+        The own ``history`` file is compacted to the last ``window``
+        records of every stage.
+        """
+        records = defaultdict(lambda: deque(maxlen=self.window))
+        n_lines = 0
+        with open(path, encoding='utf-8') as fp:
+            for line in fp:
+                n_lines += 1
+                try:
+                    record = json.loads(line)
+                    record = {'stage': record['stage'],
+                              'tokens': int(record['tokens']),
+                              'truncated': bool(record.get('truncated',
+                                                           False))}
+                    records[record['stage']].append(record)
+                except (ValueError, KeyError, TypeError):
+                    continue
+        for stage_records in records.values():
+            for record in stage_records:
+                self._add(record['stage'], record['tokens'],
+                          record['truncated'])
+        n_kept = sum(len(stage_records) for stage_records in records.values())
+        if path == self.history and n_kept < n_lines:
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                for stage_records in records.values():
+                    for record in stage_records:
+                        fp.write(json.dumps(record) + '\n')
+            os.replace(tmp_path, path)
+
+    def _add(self, stage, n_tokens, truncated):
+        if truncated:
+            self.truncations[stage] += 1
+            n_tokens = math.ceil(n_tokens * self.growth)
+        self.lengths[stage].append(n_tokens)
+
+    def observe(self, stage, n_tokens, truncated=False):
+        """Records the completion length of one finished request"""
+        if stage is None or n_tokens <= 0:
+            return
+        with self._lock:
+            self._add(stage, n_tokens, truncated)
+            if self.history is not None:
+                record = {'stage': stage, 'tokens': n_tokens,
+                          'truncated': truncated}
+                with open(self.history, 'a', encoding='utf-8') as fp:
+                    fp.write(json.dumps(record) + '\n')
+
+    def budget(self, stage, max_tokens=None):
+        """max_tokens for the next request of a stage
+
+        Parameters
+        ----------
+        stage : str
+            Pipeline stage, e.g. metrics.current_stage
+        max_tokens : int, optional
+            Cap on top of the configured max_tokens
+        """
+        cap = self.max_tokens if max_tokens is None else min(self.max_tokens,
+                                                             max_tokens)
+        with self._lock:
+            lengths = sorted(self.lengths.get(stage, ()))
+        if len(lengths) < self.min_samples:
+            # Too few to adapt down yet, but a truncation already counts
+            budget = self.defaults.get(stage, cap)
+            if lengths:
+                budget = max(budget, math.ceil(lengths[-1] * self.headroom))
+        else:
+            index = min(int(self.quantile * len(lengths)), len(lengths) - 1)
+            budget = math.ceil(lengths[index] * self.headroom)
+        return max(min(budget, cap), min(self.min_tokens, cap))
+
+    def summary(self):
+        """Current budget, samples and truncations per observed stage"""
+        with self._lock:
+            stages = list(self.lengths)
+            counts = {stage: (len(self.lengths[stage]),
+                              self.truncations[stage]) for stage in stages}
+        return {stage: {'budget': self.budget(stage), 'samples': samples,
+                        'truncations': truncations}
+                for stage, (samples, truncations) in counts.items()}
@@ -0,0 +1,84 @@
+"""Pooled keep-alive HTTP transport shared by all requests of an agent."""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Transport:
+    """Keeps one pooled ``requests.Session`` per backend endpoint
+
+    Connections are kept alive between requests, so consecutive stages
+    of a pipeline reuse the same TCP (and TLS/proxy) connection instead of
+    opening a new one for every completion.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Max number of connections kept open per backend, by default 4
+    pool_block : bool, optional
+        Wait for a free connection instead of opening an extra
+        non-pooled one when the pool is exhausted, by default False
+    """
+
+    def __init__(self, pool_size=4, pool_block=False):
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _backend_key(endpoint):
+        """Sessions are shared by scheme://host:port of the endpoint"""
+        scheme, sep, rest = endpoint.partition('://')
+        return f"{scheme}{sep}{rest.split('/', 1)[0]}"
+
+    def session(self, endpoint):
+        """Returns the pooled session for the endpoint's backend"""
+        key = self._backend_key(endpoint)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size,
+                                      pool_block=self.pool_block)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({'Content-Type': 'application/json',
+                                        'Connection': 'keep-alive'})
+                self._sessions[key] = session
+        return session
+
+    def post(self, url, **kwargs):
+        return self.session(url).post(url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session(url).get(url, **kwargs)
+
+    def close(self):
+        """Closes all pooled connections"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def get_default_transport():
+    """Process-wide transport used when no explicit one is given"""
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
@@ -1,3 +1,10 @@
+import re
+from collections import deque
+
+
+_word_re = re.compile(r'\S+')
+
+
 def split_into_words_w_newline(text):
     """Split text into words while preserving line structure"""
     if not text:
@@ -7,69 +14,109 @@ def split_into_words_w_newline(text):
     return split_text
 
 
+def _nth_word_from_end(text, n):
+    """Start index of the n-th word counted from the end, None if fewer
+
+    Only a tail of the text growing geometrically is scanned, so the
+    cost depends on n and not on the length of the document.
+    """
+    size = max(64, n * 16)
+    while True:
+        start = max(len(text) - size, 0)
+        matches = list(_word_re.finditer(text, start))
+        # A word cut by the chunk start is only usable at index > 0
+        if len(matches) > n or (start == 0 and len(matches) >= n):
+            return matches[-n].start()
+        if start == 0:
+            return None
+        size *= 2
+
+
 def remove_last_n_words(text, n):
     """Remove last n words from text while preserving line breaks"""
     if not text or n <= 0:
         return text
-        
-    split_text = split_into_words_w_newline(text)
-    if not split_text:
+    cut = _nth_word_from_end(text, n)
+    if cut is None:
         return ""
-        
-    i = 1
-    lines_to_slice = 0
-    while n > 0 and i <= len(split_text):
-        if i > len(split_text):
-            break
-        line = split_text[-i]
-        if line:
-            n_words = len(line)
-            if n_words < n:
-                n -= n_words
-                lines_to_slice += 1
-            else:
-                split_text[-i] = line[:-n]
-                break
-        i += 1
-        
-    if lines_to_slice > 0:
-        split_text = split_text[:-lines_to_slice]
-    
-    text = "\n".join([" ".join(line) for line in split_text])
-    return text.strip()
+    return text[:cut].strip()
 
 
 def keep_last_n_words(text, n):
     """Keep only last n words from text while preserving line breaks"""
     if not text or n <= 0:
         return ""
-        
-    split_text = split_into_words_w_newline(text)
-    if not split_text:
-        return ""
-        
-    total_words = sum(len(line) for line in split_text)
-    if total_words <= n:
+    cut = _nth_word_from_end(text, n)
+    if cut is None or cut == 0:
         return text  # Return all text if it's shorter than n words
-        
-    words_found = 0
-    result_lines = []
-    
-    # Process from the end
-    for line in reversed(split_text):
-        if not line:
-            if words_found < n:
-                result_lines.insert(0, [])
-            continue
-            
-        line_words = len(line)
-        if words_found + line_words <= n:
-            result_lines.insert(0, line)
-            words_found += line_words
-        else:
-            words_needed = n - words_found
-            result_lines.insert(0, line[-words_needed:])
+    return text[cut:].strip()
+
+
+def first_paragraphs(text, n):
+    """Leading paragraphs of text, stopping once they reach n words"""
+    if not text or n <= 0:
+        return ""
+    kept = []
+    n_words = 0
+    for paragraph in text.split('\n\n'):
+        kept.append(paragraph)
+        n_words += len(_word_re.findall(paragraph))
+        if n_words >= n:
             break
-    
-    text = "\n".join([" ".join(line) for line in result_lines])
-    return text.strip()
+    return '\n\n'.join(kept).strip()
+
+
+class TailWindow:
+    """Rolling tail of the last n words of a growing manuscript
+
+    Appended pieces (scenes) are counted once and pieces that fall
+    completely out of the window are dropped, so the tail never requires
+    splitting the whole manuscript again.
+
+    Parameters
+    ----------
+    n : int
+        Number of words kept
+    separator : str, optional
+        Inserted between appended pieces, by default an empty line
+    """
+
+    def __init__(self, n, separator='\n\n'):
+        self.n = n
+        self.separator = separator
+        self._pieces = deque()
+        self._n_words = 0
+
+    def append(self, text):
+        if not text:
+            return
+        n_words = len(_word_re.findall(text))
+        self._pieces.append((text, n_words))
+        self._n_words += n_words
+        while self._pieces and self._n_words - self._pieces[0][1] >= self.n:
+            _, dropped = self._pieces.popleft()
+            self._n_words -= dropped
+
+    def clear(self):
+        self._pieces.clear()
+        self._n_words = 0
+
+    def text(self):
+        """The last n words, None if nothing was appended"""
+        if not self._pieces:
+            return None
+        text = self.separator.join(piece for piece, _ in self._pieces)
+        return keep_last_n_words(text, self.n)
+
+
+def common_prefix_len(a, b):
+    """Length of the common prefix of two strings"""
+    # Binary search over slice comparisons, these run at C speed
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
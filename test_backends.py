@@ -0,0 +1,52 @@
+import time
+
+from goat_storytelling_agent.backends import BackendPool
+from goat_storytelling_agent.mock_server import MockKoboldServer
+
+
+def test_breaker_opens_and_resets():
+    with MockKoboldServer() as server:
+        pool = BackendPool([server.uri, 'http://127.0.0.1:9/v1'],
+                           recheck_interval=0.05)
+        backend = pool.backends[0]
+        backend.outstanding += 1
+        pool.release(backend, ok=False)
+        assert not backend.healthy
+        assert backend.opens == 1
+        assert backend.open_until is not None
+        # Open backends are routed around
+        other = pool.acquire()
+        assert other is pool.backends[1]
+        pool.release_slot(other)
+
+        # Once the open interval is over the health check closes it again
+        time.sleep(0.1)
+        assert pool.acquire() is backend
+        assert backend.healthy
+        assert backend.open_until is None
+        pool.release(backend, ok=True)
+        assert backend.failures == 0
+        assert backend.opens == 0
+        assert backend.outstanding == 0
+
+
+def test_release_slot_keeps_breaker_state():
+    pool = BackendPool(['http://a/v1', 'http://b/v1'])
+    backend = pool.acquire()
+    backend.failures = 2
+    backend.opens = 1
+    pool.release_slot(backend)
+    assert backend.outstanding == 0
+    assert backend.failures == 2
+    assert backend.opens == 1
+
+
+def test_sticky_keys_are_bounded():
+    pool = BackendPool(['http://a/v1', 'http://b/v1'], max_sticky=2)
+    first = pool.acquire('book-1')
+    pool.release_slot(first)
+    for key in ('book-2', 'book-1', 'book-3'):
+        pool.release_slot(pool.acquire(key))
+    # book-2 was the least recently used key
+    assert list(pool._sticky) == ['book-1', 'book-3']
+    assert pool.acquire('book-1') is first
@@ -0,0 +1,91 @@
+import json
+import os
+import time
+
+from goat_storytelling_agent import GenerationBudgets, StoryAgent
+from goat_storytelling_agent.cache import ResponseCache
+from goat_storytelling_agent.mock_server import MockKoboldServer
+from goat_storytelling_agent.monitors import RepetitionMonitor
+
+MESSAGES = [{'role': 'user', 'content': 'Write a scene'}]
+
+
+def _set_mtime(cache, key, mtime):
+    os.utime(cache._entry_path(key), (mtime, mtime))
+
+
+def test_key_covers_max_tokens_and_options():
+    key = ResponseCache.make_key(MESSAGES, 100, {'temperature': 0.8})
+    assert key == ResponseCache.make_key(MESSAGES, 100, {'temperature': 0.8})
+    assert key != ResponseCache.make_key(MESSAGES, 200, {'temperature': 0.8})
+    assert key != ResponseCache.make_key(MESSAGES, 100, {'temperature': 0.7})
+
+
+def test_query_chat_keys_on_effective_max_tokens(tmp_path):
+    def agent(server, budget):
+        budgets = GenerationBudgets(defaults={None: budget})
+        return StoryAgent(server.uri, token_sink='silent',
+                          cache=str(tmp_path), generation_budgets=budgets)
+
+    with MockKoboldServer() as server:
+        short = agent(server, 10).query_chat(MESSAGES)
+        longer = agent(server, 100).query_chat(MESSAGES)
+        assert server.n_requests == 2
+        assert len(longer.split()) > len(short.split())
+        assert agent(server, 100).query_chat(MESSAGES) == longer
+        agent(server, 100).query_chat(MESSAGES, options={'temperature': 0})
+        assert server.n_requests == 3
+
+
+def test_lru_eviction_by_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_entries=3)
+    now = time.time()
+    for i, key in enumerate('abc'):
+        cache.set(key, key.upper())
+        _set_mtime(cache, key, now - 100 + i)
+    # Reading 'a' makes 'b' the least recently used entry
+    assert cache.get('a') == 'A'
+    cache.set('d', 'D')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['A', 'C', 'D']
+
+
+def test_eviction_by_size(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.set('a', 'x' * 1000)
+    size = os.path.getsize(cache._entry_path('a'))
+    cache = ResponseCache(str(tmp_path), max_bytes=2 * size + 10)
+    _set_mtime(cache, 'a', time.time() - 100)
+    cache.set('b', 'y' * 1000)
+    _set_mtime(cache, 'b', time.time() - 50)
+    cache.set('c', 'z' * 1000)
+    assert cache.get('a') is None
+    assert cache.get('b') and cache.get('c')
+
+
+def test_max_age(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_age=60)
+    cache.set('a', 'A')
+    assert cache.get('a') == 'A'
+    fpath = cache._entry_path('a')
+    with open(fpath, 'w', encoding='utf-8') as fp:
+        json.dump({'created': time.time() - 120, 'result': 'A'}, fp)
+    assert cache.get('a') is None
+    assert not os.path.exists(fpath)
+
+
+def test_empty_and_degenerate_results_are_not_stored(tmp_path):
+    def responder(data):
+        if 'loop' in data['messages'][-1]['content']:
+            return 'the same words again ' * 100
+        return ''
+
+    with MockKoboldServer(responder=responder) as server:
+        agent = StoryAgent(server.uri, token_sink='silent',
+                           cache=str(tmp_path))
+        assert agent.query_chat(MESSAGES) == ''
+        looping = [{'role': 'user', 'content': 'Write a loop'}]
+        monitor = RepetitionMonitor()
+        assert agent.query_chat(looping, monitors=[monitor])
+        assert monitor.degenerate
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,43 @@
+import contextlib
+import io
+
+from goat_storytelling_agent import StoryAgent
+from goat_storytelling_agent.journal import BookJournal
+from goat_storytelling_agent.mock_server import (MockKoboldServer,
+                                                 SyntheticResponder)
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    journal = BookJournal(str(tmp_path / 'book.jsonl'))
+    journal.append('topic', topic='A heist')
+    journal.append('scene', ch=1, sc=1, text='First scene')
+    with open(journal.path, 'a', encoding='utf-8') as fp:
+        fp.write('{"type": "scene", "ch": 1, "sc": 2, "te')
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = journal.load()
+    assert state['topic'] == 'A heist'
+    assert state['scenes'] == {(1, 1): 'First scene'}
+
+    # A record written after the torn line starts on a line of its own
+    journal.append('scene', ch=1, sc=2, text='Second scene')
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = journal.load()
+    assert state['scenes'] == {(1, 1): 'First scene', (1, 2): 'Second scene'}
+
+
+def test_plan_regeneration_report(tmp_path):
+    path = str(tmp_path / 'book.jsonl')
+    with MockKoboldServer(
+            responder=SyntheticResponder(scene_words=100)) as server:
+        agent = StoryAgent(server.uri, token_sink='silent')
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent.generate_story('A heist', journal=path)
+        plan = agent.journal_plan(path)
+        assert agent.plan_regeneration(path, plan) == {
+            'acts': [], 'chapters': [], 'scenes': []}
+
+        first = plan[0]['chapters'][0]
+        plan[0]['chapters'] = [first, 'A completely new second chapter']
+        assert agent.plan_regeneration(path, plan) == {
+            'acts': [1], 'chapters': [2],
+            'scenes': [(2, 1), (2, 2), (3, 1)]}
@@ -0,0 +1,106 @@
+import json
+
+from goat_storytelling_agent.mock_server import MockKoboldServer
+from goat_storytelling_agent.monitors import RepetitionMonitor, SceneHeaderStop
+from goat_storytelling_agent.sinks import SilentTokenSink
+from goat_storytelling_agent.storytelling_agent import (StoryAgent,
+                                                        _query_chat_koboldcpp)
+
+
+class StubResponse:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for token in self.tokens:
+            event = {'choices': [{'index': 0, 'delta': {'content': token}}]}
+            yield f'data: {json.dumps(event)}'.encode('utf-8')
+        yield b'data: [DONE]'
+
+    def close(self):
+        pass
+
+
+class StubTransport:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def post(self, url, **kwargs):
+        return StubResponse(self.tokens)
+
+
+def _scene(tokens, monitors):
+    text = _query_chat_koboldcpp(
+        'http://stub/v1', [{'role': 'user', 'content': 'Write'}],
+        transport=StubTransport(tokens), monitors=monitors,
+        token_sink=SilentTokenSink())
+    return StoryAgent.prepare_scene_text(text)
+
+
+def test_header_split_into_tokens_is_cut():
+    tokens = ['Chapter 2\n', 'Scene 1\n\n', 'Rain', ' fell', '.\n', 'Then',
+              ' more', ' rain', '.\n', 'Wind', '.\n', 'Night', ' came',
+              '.\n\n', 'Chapter', ' ', '3', '\n', 'Scene 1\n', 'Other']
+    with_monitor = _scene(tokens, [SceneHeaderStop()])
+    assert with_monitor.rstrip() == _scene(tokens, []).rstrip()
+    assert not with_monitor.rstrip().endswith('Chapter')
+
+
+def test_leading_blank_line_keeps_header_zone():
+    tokens = ['\n', 'Title\n', 'x\n', 'y\n', 'z\n', 'Chapter 2\n',
+              'Scene 1\n', 'The body of the scene goes on here.\n\n',
+              'Chapter 3\n', 'Next']
+    with_monitor = _scene(tokens, [SceneHeaderStop()])
+    assert 'The body of the scene goes on here.' in with_monitor
+    assert with_monitor.rstrip() == _scene(tokens, []).rstrip()
+
+
+PROSE = ('Mali counted the steps from the market to the station twice. '
+         'The first time the rain had just started, the second time it was '
+         'already over and the square smelled of wet dust. Arun waited by '
+         'the newspaper stand with a folded map and a cold coffee, pretending '
+         'to read about a football match he had not watched. Nobody looked '
+         'at them. A tram rang somewhere behind the bakery, a dog barked at '
+         'a delivery van, and the clock above the ticket hall was four '
+         'minutes slow, as it had been for years. She sat down next to him '
+         'and asked whether the plan still held. He said the guard changed '
+         'at nine now, not at eight, and that the side door would be locked '
+         'from the inside. They would need the baker after all.')
+
+
+def test_repetition_monitor_stops_loop():
+    monitor = RepetitionMonitor()
+    tokens = [f'{word} ' for word in
+              ('The door was locked again and ' * 60).split()]
+    text = _scene(tokens, [monitor])
+    assert monitor.degenerate
+    assert len(text.split()) < len(tokens) / 2
+
+
+def test_repetition_monitor_leaves_prose_alone():
+    monitor = RepetitionMonitor()
+    tokens = [f'{word} ' for word in PROSE.split()]
+    text = _scene(tokens, [monitor])
+    assert not monitor.degenerate
+    assert text.split() == PROSE.split()
+
+
+def test_query_scene_retries_with_repetition_options():
+    requests = []
+
+    def responder(data):
+        requests.append(data)
+        if data['temperature'] == 0.5:
+            return PROSE
+        return 'The door was locked again and ' * 60
+
+    with MockKoboldServer(responder=responder) as server:
+        agent = StoryAgent(server.uri, token_sink='silent',
+                           repetition_retry_options={'temperature': 0.5})
+        text = agent.query_scene([{'role': 'user', 'content': 'Write'}])
+    assert [data['temperature'] for data in requests] == [0.9, 0.5]
+    assert text.split() == PROSE.split()
+    assert agent.stage_retries['scene'] == 1
@@ -0,0 +1,65 @@
+import contextlib
+import io
+
+from goat_storytelling_agent import StoryAgent
+from goat_storytelling_agent.mock_server import MockKoboldServer
+from goat_storytelling_agent.plan import Act, Plan
+
+ACTS = [
+    {'act_descr': 'Act 1: Setup', 'chapters': ['A heist is planned',
+                                               'The crew meets']},
+    {'act_descr': 'Act 2: Heist', 'chapters': ['The vault opens']},
+]
+
+
+def _plan():
+    plan = Plan(ACTS)
+    # Fills the memo
+    assert Plan.plan_2_str(plan) == Plan.plan_2_str(ACTS)
+    return plan
+
+
+def test_act_descr_invalidates_renderings():
+    plan = _plan()
+    plan[1].act_descr = 'Act 2: The heist goes wrong'
+    assert 'goes wrong' in Plan.plan_2_str(plan)
+
+
+def test_chapters_invalidate_renderings():
+    plan = _plan()
+    plan[1].chapters = ['The vault opens', 'The alarm rings']
+    assert 'The alarm rings' in Plan.plan_2_str(plan)
+    assert plan.chapter(4).text == 'The alarm rings'
+
+
+def test_setitem_invalidates_renderings():
+    plan = _plan()
+    plan[0]['chapters'] = ['A heist is planned']
+    assert 'The crew meets' not in Plan.plan_2_str(plan)
+    plan[1] = Act('Act 2: Escape', ['They run'])
+    text = Plan.plan_2_str(plan)
+    assert 'They run' in text and 'The vault opens' not in text
+
+
+def test_chapter_text_invalidates_renderings():
+    plan = _plan()
+    window = Plan.window_2_str(plan, 3)
+    plan[0].chapters[0].text = 'A robbery is planned'
+    assert 'A robbery is planned' in Plan.plan_2_str(plan)
+    assert plan[0]['chapters'][0] == 'A robbery is planned'
+    plan[1].chapters[0].text = 'The vault stays shut'
+    assert Plan.window_2_str(plan, 3) != window
+
+
+def test_enhance_keeps_acts_without_usable_answer():
+    acts = ACTS + [{'act_descr': 'Act 3: Escape',
+                    'chapters': ['They run', 'They hide']}]
+    with MockKoboldServer(responder=lambda data: 'Act 1: Nothing') as server:
+        agent = StoryAgent(server.uri, token_sink='silent')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            _, plan = agent.enhance_plot_chapters('spec', Plan(acts),
+                                                  max_tries=2)
+        assert server.n_requests == 6
+    assert plan == acts
+    assert out.getvalue().count('keeping it') == 3
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from goat_storytelling_agent.scheduler import BookJob, RequestGate, current_job
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _request(gate, job, order, hold=0.0, counts=None):
+    current_job.set(job)
+    with gate.slot():
+        order.append(job.job_id)
+        if counts is not None:
+            with counts['lock']:
+                counts['now'] += 1
+                counts['max'] = max(counts['max'], counts['now'])
+            time.sleep(hold)
+            with counts['lock']:
+                counts['now'] -= 1
+
+
+def test_priority_then_fewest_served():
+    gate = RequestGate(max_in_flight=1)
+    gate.served['c'] = 2
+    jobs = [BookJob('a', 'A'), BookJob('b', 'B', priority=1),
+            BookJob('c', 'C'), BookJob('d', 'D')]
+    order = []
+    threads = []
+    with gate.slot():
+        for n_waiting, job in enumerate(jobs, start=1):
+            thread = threading.Thread(target=_request,
+                                      args=(gate, job, order))
+            thread.start()
+            threads.append(thread)
+            # Queue them in a known order
+            _wait_for(lambda: len(gate._waiting) == n_waiting)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['b', 'a', 'd', 'c']
+
+
+def test_max_in_flight():
+    gate = RequestGate(max_in_flight=2)
+    counts = {'now': 0, 'max': 0, 'lock': threading.Lock()}
+    order = []
+    threads = [threading.Thread(target=_request,
+                                args=(gate, BookJob(i, 'T'), order, 0.02,
+                                      counts))
+               for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(order) == 6
+    assert counts['max'] == 2
+    assert gate.in_flight == 0
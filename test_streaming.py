@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import io
+import json
+
+from goat_storytelling_agent.async_agent import AsyncStoryAgent
+from goat_storytelling_agent.mock_server import (MockKoboldServer,
+                                                 SyntheticResponder)
+from goat_storytelling_agent.monitors import SceneHeaderStop
+from goat_storytelling_agent.plan import Plan
+from goat_storytelling_agent.sinks import SilentTokenSink
+from goat_storytelling_agent.storytelling_agent import (StoryAgent,
+                                                        _query_chat_koboldcpp)
+
+SCENE = ('Chapter 2\nScene 1\n\nRain fell on the market.\n'
+         'Mali hid the phone.\nThe train left without them.\n'
+         'Nobody on the platform looked up.\n\n'
+         'Chapter 3\nScene 1\nArun woke up in another city.')
+
+
+def _query(server, monitors=None):
+    return _query_chat_koboldcpp(
+        server.uri, [{'role': 'user', 'content': 'Write scene 1'}],
+        monitors=monitors, backoff_base=0.01, token_sink=SilentTokenSink())
+
+
+def test_header_stop_against_mock_server():
+    with MockKoboldServer(responder=lambda data: SCENE) as server:
+        stopped = _query(server, [SceneHeaderStop()])
+        full = _query(server)
+    assert 'Arun' not in stopped
+    assert not stopped.endswith('Chapter')
+    assert (StoryAgent.prepare_scene_text(stopped).rstrip()
+            == StoryAgent.prepare_scene_text(full).rstrip())
+
+
+def test_resume_after_broken_stream():
+    requests = []
+    responder = SyntheticResponder(scene_words=60)
+
+    def record(data):
+        requests.append(data['messages'])
+        return responder(data)
+
+    with MockKoboldServer(responder=record, drop_after=10) as server:
+        text = _query(server)
+        assert server.n_requests == 2
+    # The retry continues the partial answer instead of starting over
+    partial = requests[1][-1]
+    assert partial['role'] == 'assistant'
+    assert partial['content'].strip()
+    assert text.startswith(partial['content'].strip())
+    assert len(text.split()) > len(partial['content'].split())
+
+
+def test_grammar_restart_resets_stats():
+    requests = []
+
+    def record(data):
+        requests.append(data)
+        return 'one two three four five six seven eight nine ten eleven'
+
+    with MockKoboldServer(responder=record, drop_after=4) as server:
+        stats = {}
+        text = _query_chat_koboldcpp(
+            server.uri, [{'role': 'user', 'content': 'Write JSON'}],
+            extra_options={'grammar': 'root ::= [a-z ]+'},
+            backoff_base=0.01, stats=stats, token_sink=SilentTokenSink())
+    # The grammar constrained request starts over, without a prefill
+    assert len(requests) == 2
+    assert requests[1]['messages'][-1]['role'] == 'user'
+    assert text.startswith('one two')
+    assert stats['deltas'] == len(text.split())
+
+
+class ChunkResponse:
+    def __init__(self, events):
+        self.events = events
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for event in self.events:
+            yield f'data: {json.dumps(event)}'.encode('utf-8')
+        yield b'data: [DONE]'
+
+    def close(self):
+        pass
+
+
+class ChunkTransport:
+    def __init__(self, events):
+        self.events = events
+
+    def post(self, url, **kwargs):
+        return ChunkResponse(self.events)
+
+
+def test_only_content_deltas_are_counted():
+    events = [{'choices': [{'index': 0, 'delta': {'role': 'assistant'}}]},
+              {'choices': [{'index': 0, 'delta': {'content': 'Rain'}}]},
+              {'choices': [{'index': 0, 'delta': {'content': ' fell'}}]},
+              {'choices': [{'index': 0, 'delta': {},
+                            'finish_reason': 'stop'}]}]
+    stats = {}
+    text = _query_chat_koboldcpp(
+        'http://stub/v1', [{'role': 'user', 'content': 'Write'}],
+        transport=ChunkTransport(events), stats=stats,
+        token_sink=SilentTokenSink())
+    assert text == 'Rain fell'
+    assert stats['deltas'] == 2
+    assert stats['finish_reason'] == 'stop'
+
+
+def test_silent_sink_keeps_best_of_n_quiet():
+    plan = Plan([{'act_descr': 'Act 1: Setup',
+                  'chapters': ['A heist is planned in the city']}])
+    out = io.StringIO()
+    with MockKoboldServer(
+            responder=SyntheticResponder(scene_words=80)) as server:
+        agent = StoryAgent(server.uri, token_sink='silent',
+                           scene_candidates=3, candidate_threshold=1.1)
+        with contextlib.redirect_stdout(out):
+            _, text = agent.write_a_scene('Mali plans the heist', 1, 1, plan)
+        assert server.n_requests == 3
+    assert text
+    assert out.getvalue() == ''
+
+
+def test_aquery_chat_forwards_all_options():
+    requests = []
+
+    def record(data):
+        requests.append(data)
+        return 'Rain fell.'
+
+    with MockKoboldServer(responder=record) as server:
+        agent = AsyncStoryAgent(server.uri, token_sink='silent')
+        try:
+            text = asyncio.run(agent.aquery_chat(
+                [{'role': 'user', 'content': 'Write'}], use_cache=False,
+                monitors=[SceneHeaderStop()], stop=['THE END'],
+                grammar='root ::= [a-zA-Z .]+', options={'temperature': 0.1}))
+        finally:
+            agent.close()
+    assert text == 'Rain fell.'
+    assert requests[0]['stop'] == ['THE END']
+    assert requests[0]['grammar'] == 'root ::= [a-zA-Z .]+'
+    assert requests[0]['temperature'] == 0.1
@@ -0,0 +1,95 @@
+import pytest
+
+from goat_storytelling_agent import StoryAgent
+from goat_storytelling_agent.metrics import current_stage
+from goat_storytelling_agent.mock_server import MockKoboldServer
+from goat_storytelling_agent.sinks import CallbackTokenSink
+from goat_storytelling_agent.tokens import ContextBudget, GenerationBudgets
+
+
+def test_fit_max_tokens_never_raises_the_request():
+    budget = ContextBudget(8192)
+    assert budget.fit_max_tokens(100, 120) == 120
+    assert budget.fit_max_tokens(100, 64) == 64
+
+
+def test_fit_max_tokens_squeezes_down_to_min_generation():
+    budget = ContextBudget(8192, margin=64, min_generation=256)
+    assert budget.fit_max_tokens(6000, 4096) == 8192 - 6000 - 64
+    assert budget.fit_max_tokens(8000, 4096) == 256
+
+
+def test_prompt_budgets_are_keyed_by_stage():
+    budget = ContextBudget(8192, margin=64,
+                           prompt_budgets={'write_a_scene': 3000})
+    assert budget.prompt_budget(1024, stage='write_a_scene') == 3000
+    assert budget.prompt_budget(1024, stage='continue_a_scene') == 7104
+    with pytest.raises(ValueError):
+        ContextBudget(8192, prompt_budgets={'scene': 3000})
+
+
+def test_prompt_budget_checked_for_every_stage():
+    with MockKoboldServer() as server:
+        status = []
+        agent = StoryAgent(server.uri,
+                           token_sink=CallbackTokenSink(lambda token: None,
+                                                        status.append),
+                           context_size=8192,
+                           prompt_budgets={'enhance_book_spec': 5})
+        token = current_stage.set('enhance_book_spec')
+        try:
+            agent.query_chat([{'role': 'user',
+                               'content': 'A long enough prompt'}])
+        finally:
+            current_stage.reset(token)
+    assert any('enhance_book_spec prompt' in text for text in status)
+
+
+def test_budget_is_quantile_with_headroom():
+    budgets = GenerationBudgets(quantile=0.5, headroom=1.25, min_samples=5)
+    for n_tokens in range(100, 1001, 100):
+        budgets.observe('write_a_scene', n_tokens)
+    assert budgets.budget('write_a_scene') == 750
+    assert budgets.budget('write_a_scene', max_tokens=500) == 500
+
+
+def test_budget_default_until_enough_samples():
+    budgets = GenerationBudgets(min_samples=5, headroom=1.25)
+    budgets.observe('summarize_acts', 100)
+    assert budgets.budget('summarize_acts') == 512
+    budgets.observe('summarize_acts', 1000)
+    assert budgets.budget('summarize_acts') == 1250
+
+
+def test_truncated_answers_grow_the_budget():
+    budgets = GenerationBudgets(min_samples=1, headroom=1.25, growth=2)
+    budgets.observe('write_a_scene', 300, truncated=True)
+    assert budgets.budget('write_a_scene') == 750
+    assert budgets.summary()['write_a_scene']['truncations'] == 1
+
+
+def test_history_round_trip(tmp_path):
+    path = str(tmp_path / 'budgets.jsonl')
+    budgets = GenerationBudgets(history=path, min_samples=2)
+    for n_tokens in (200, 400, 600):
+        budgets.observe('write_a_scene', n_tokens)
+    budgets.observe('summarize_acts', 100, truncated=True)
+    loaded = GenerationBudgets(history=path, min_samples=2)
+    assert loaded.summary() == budgets.summary()
+
+
+def test_history_is_compacted_on_load(tmp_path):
+    path = str(tmp_path / 'budgets.jsonl')
+    budgets = GenerationBudgets(history=path, window=3)
+    for n_tokens in range(100, 1100, 100):
+        budgets.observe('write_a_scene', n_tokens)
+    budgets.observe('summarize_acts', 50)
+    with open(path, 'a', encoding='utf-8') as fp:
+        fp.write('{"stage": "write_a_sc')
+    loaded = GenerationBudgets(history=path, window=3)
+    with open(path, encoding='utf-8') as fp:
+        lines = fp.readlines()
+    assert len(lines) == 4
+    assert list(loaded.lengths['write_a_scene']) == [800, 900, 1000]
+    assert GenerationBudgets(history=path, window=3).summary() == \
+        loaded.summary()